@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from entry_store import log_store
+from analytics_store import aggregates
+from topic_engine import topic_engine
+
+#how many (dataset, parameters) results to keep
+CACHE_SIZE = 64
+
+#the dashboard aggregates as plain json, built from the running counters (analytics_store.py)
+#and the topic engine, each dataset: name -> (builder, {parameter: (default, maximum)}), a text
+#parameter's maximum is its length
+def sentiment_data(counts):
+    return {"counts": dict(counts["sentiment"]), "total": sum(counts["sentiment"].values())}
+
+def flags_data(counts):
+    return {"counts": dict(counts["flagged"]), "total": sum(counts["flagged"].values())}
+
+def reasons_data(counts):
+    return {"counts": dict(counts["reasons"].most_common())}
+
+def keywords_data(counts, limit):
+    return {"keywords": [[keyword, count] for keyword, count in counts["keywords"].most_common(limit)]}
+
+def wordcloud_data(counts, limit, reason):
+    #same words the wordcloud image shows: stop words dropped, heaviest first
+    from wordcloud import STOPWORDS #pulls in matplotlib, only when this dataset is asked for
+
+    terms = counts["terms"]
+    if reason:
+        #only the entries flagged for this reason, counted from the analytics snapshot's columns
+        from content_analysis import term_frequencies
+        terms = term_frequencies(reason_filter=reason)
+    terms = ((term, count) for term, count in terms.most_common() if term.lower() not in STOPWORDS and count > 0)
+    words = []
+    for term, count in terms:
+        if len(words) >= limit:
+            break
+        words.append([term, count])
+    return {"terms": words}
+
+def topics_data(counts, terms):
+    #only reads the saved model, it is updated by the dashboard refresh (render_scheduler.py) or,
+    #with several server processes, by the refresher (serve.py), never inside a request
+    return {"topics": [{"terms": words, "weights": [round(weight, 6) for weight in weights]}
+                       for words, weights in topic_engine.topics(terms)]}
+
+DATASETS = {
+    "sentiment": (sentiment_data, {}),
+    "flags": (flags_data, {}),
+    "reasons": (reasons_data, {}),
+    "keywords": (keywords_data, {"limit": (10, 100)}),
+    "wordcloud": (wordcloud_data, {"limit": (100, 500), "reason": ("", 100)}),
+    "topics": (topics_data, {"terms": (5, 20)}),
+}
+
+#the dashboard image drawn from each dataset (content_analysis.chart_inputs), for png exports
+CHART_FILES = {
+    "sentiment": "sentiment_distribution.png",
+    "flags": "flagging_distribution.png",
+    "reasons": "flag_reason_chart.png",
+    "keywords": "top_flagged_keywords.png",
+    "wordcloud": "all_inclusive_cloud.png",
+    "topics": "topic_model.png",
+}
+
+def data_version():
+    #the topic model is its own version: with several server processes it is saved by the
+    #refresher a little after the content log changed (serve.py)
+    return log_store.version, topic_engine.model_version
+
+def parse_params(name, args):
+    '''Dataset parameters from query args (a dict-like of strings), clamped to their range'''
+    params = {}
+    for param, (default, maximum) in DATASETS[name][1].items():
+        if isinstance(default, str):
+            params[param] = str(args.get(param, default)).strip()[:maximum]
+            continue
+        try:
+            value = int(args.get(param, default))
+        except (TypeError, ValueError):
+            value = default
+        params[param] = min(max(value, 1), maximum)
+    return tuple(sorted(params.items()))
+
+
+#lru cache of encoded analytics results, keyed by dataset + parameters
+#every write to the content log (or a new topic model) bumps the version, which drops the whole
+#cache, and the version is part of the etag so an unchanged result is answered with a 304 before
+#anything is built
+class AnalyticsCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._results = OrderedDict() #(name, params) -> encoded json, least recently used first
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def etag(self, name, params, version=None):
+        version = data_version() if version is None else version
+        return hashlib.sha1(f"{name}|{params}|{version}".encode()).hexdigest()
+
+    def get(self, name, params):
+        '''(etag, encoded json) for one dataset, built at most once per content log version'''
+        version = data_version()
+        key = (name, params)
+        with self._lock:
+            if version != self._version:
+                self._results.clear()
+                self._version = version
+            payload = self._results.get(key)
+            if payload is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self.etag(name, params, version), payload
+
+        builder = DATASETS[name][0]
+        while True:
+            body = builder(aggregates.snapshot(), **dict(params))
+            #reading may have applied another process' writes or loaded a newer topic model, the
+            #etag must name the version the body was built from, so build again until it holds still
+            current = data_version()
+            if current == version:
+                break
+            version = current
+        payload = json.dumps(body, separators=(",", ":"))
+        with self._lock:
+            self.misses += 1
+            #a write that landed while building already cleared the cache, don't store stale data
+            if version == self._version:
+                self._results[key] = payload
+                if len(self._results) > self.size:
+                    self._results.popitem(last=False)
+        return self.etag(name, params, version), payload
+
+    def metrics(self):
+        with self._lock:
+            return {"size": len(self._results), "hits": self.hits, "misses": self.misses}
+
+
+analytics_cache = AnalyticsCache()
@@ -0,0 +1,90 @@
+import re
+from collections import Counter
+
+from entry_store import StoreIndex, log_store
+
+#same word pattern wordcloud uses (plus curly apostrophes, common in pasted text),
+#numbers are left out like wordcloud does by default
+WORD = re.compile(r"\w[\w'’]*")
+
+#the pieces each chart is built from, computed for one log entry
+#(the per-entry logic that used to run over the whole dataframe in content_analysis)
+def entry_reasons(reason):
+    if reason is None or reason == "NOT FLAGGED":
+        return []
+    if isinstance(reason, list):
+        # Shouldn't happen if reason was stored correctly, but just in case
+        flag_labels = reason
+    else:
+        flag_labels = [r.strip() for r in str(reason).split(';')]
+
+    reasons = []
+    for i in flag_labels:
+        if i.startswith("KEYWORD"):
+            reasons.append("KEYWORD")
+        elif i:  # skip empty strings
+            reasons.append(i)
+    return reasons
+
+def entry_terms(cleaned_text):
+    if not isinstance(cleaned_text, str):
+        return []
+    terms = []
+    for word in WORD.findall(cleaned_text):
+        if word.isdigit():
+            continue
+        if word.lower().endswith(("'s", "’s")):
+            word = word[:-2]
+        terms.append(word)
+    return terms
+
+def entry_keywords(entry):
+    #only flagged entries count towards the keyword chart
+    if entry.get("flagged") is not True:
+        return []
+    return [keyword for keyword in entry.get("keywords") or [] if keyword is not None]
+
+
+#running counters for the admin dashboard, updated per logged entry and decremented on delete
+#so a refresh never has to reload and recount the whole content log
+class AnalyticsAggregates(StoreIndex):
+    COUNTERS = ("sentiment", "flagged", "reasons", "keywords", "terms")
+
+    def reset(self):
+        self.counts = {name: Counter() for name in self.COUNTERS}
+
+    def _pieces(self, entry):
+        return {
+            "sentiment": [entry["sentiment"]] if entry.get("sentiment") is not None else [],
+            "flagged": [str(entry["flagged"])] if entry.get("flagged") is not None else [],
+            "reasons": entry_reasons(entry.get("reason")),
+            "keywords": entry_keywords(entry),
+            "terms": entry_terms(entry.get("cleaned_text")),
+        }
+
+    def on_put(self, entry):
+        for name, values in self._pieces(entry).items():
+            self.counts[name].update(values)
+
+    def on_delete(self, entry):
+        for name, values in self._pieces(entry).items():
+            counter = self.counts[name]
+            counter.subtract(values)
+            for value in set(values):
+                if counter[value] <= 0:
+                    del counter[value]
+
+    def to_snapshot(self):
+        return {name: dict(counter) for name, counter in self.counts.items()}
+
+    def from_snapshot(self, state):
+        self.counts = {name: Counter(state.get(name, {})) for name in self.COUNTERS}
+
+    def snapshot(self):
+        '''A copy of every counter, consistent with the current content log'''
+        with self.store.reading():
+            return {name: Counter(counter) for name, counter in self.counts.items()}
+
+
+aggregates = AnalyticsAggregates("analytics_aggregates.json")
+log_store.add_index(aggregates)
@@ -1,51 +1,187 @@
-from flask import Flask, request, jsonify
-import json 
+from flask import Flask, request, jsonify, Response, send_from_directory, g
 from flask_cors import CORS
 from datetime import datetime 
 import uuid #package for creating parent ids
-from sentimental_analysis import analyze_sentiment_toxicity as analyze
-from sentimental_analysis import flag_keywords as flag #importing sentiment analysis functions
-from log_moderation import log_content #importing logging function
-import subprocess
-from content_analysis import run_analysis
+from batching import scheduler #concurrent submits share one batched forward pass
+from entry_store import raw_store, log_store
+from tag_index import tag_index
+from search_index import search_index
+from pagination import order_index, encode_cursor, decode_cursor, DEFAULT_LIMIT, MAX_LIMIT
+import hashlib
+import hmac
+from model_registry import registry
+from moderation_jobs import pipeline #classification, logging and dashboard refresh run in the background
+from render_scheduler import render_scheduler #debounced, incremental dashboard re-renders
+from analytics_cache import analytics_cache, DATASETS, CHART_FILES, parse_params
+from charts import STATIC_PATH
+from classification_cache import classification_cache
+from text_normalizer import cache_stats
+import os
+import sys
+import threading
+import logging
+import cProfile
+import random
+from time import perf_counter
+from topic_engine import topic_engine
+from metrics import metrics, STAGE_SECONDS
+
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Allow frontend requests
 
-#global variable storing all data 
-DATA = "./user-text.json"
+#raw entries live in an append-only log (user-text.jsonl), migrated from user-text.json on first use
+#see entry_store.py
+DATA = raw_store
 
 #function for reading data (entries only) 
 #because tag_dict is not reacted from the front end, only created in the back end (in this file) 
 #we only want to send and request entries
 def read_data():
-    try: 
-        with open(DATA, "r") as file: 
-            data = json.load(file)  
-            return data.get("entries", [])
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
-
-#function for writing data 
-#at this stage we build/update the tag_dict 
+    return DATA.entries()
+
+#function for writing data, one appended line per entry instead of rewriting the whole file
 def write_data(entries): 
-    data = {
-        "entries": entries, 
-        "tag_dict": build_tag_dict(entries)
-    }
-    with open(DATA, "w") as file: 
-        json.dump(data, file, indent=4)
+    with STAGE_SECONDS.time(stage="raw_store_write"):
+        DATA.put_many(entries)
 
 #connecting to front end react
+#returns one page of entries (newest first), query parameters:
+#   limit      page size (default 100, at most 500)
+#   cursor     continue with the entries older than this cursor (next_cursor of the previous page)
+#   since      delta mode, only entries newer than this cursor (oldest first)
+#   tag, parent_id ("none" for top level posts), flagged (true/false) filters
+#tags are served separately by /tags and /tags/<tag>
 @app.route("/get-data", methods=["GET"])
 def get_data(): 
-    #get data, returns input before splitting between entries and tags and writing into the json
-    try: 
-        with open(DATA, "r") as file: 
-            data = json.load(file) 
-            return jsonify(data), 200
-    except (FileNotFoundError, json.JSONDecodeError):
-        return jsonify({"entries":[], "tag_dict": {}}), 200
+    args = request.args
+    limit = min(max(args.get("limit", DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    try:
+        cursor = decode_cursor(args.get("cursor"))
+        since = decode_cursor(args.get("since"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    #nothing on a page can change unless one of the stores was written, so the etag is known
+    #before doing any work and an unchanged page costs neither a lookup nor a json encode
+    flagged = args.get("flagged")
+    versions = (DATA.version, log_store.version if flagged is not None else 0)
+    etag = hashlib.sha1(f"{versions}|{sorted(args.items())}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    entries, next_cursor = order_index.page(cursor=cursor, since=since, limit=limit,
+                                            match=entry_filter(args.get("tag"), args.get("parent_id"), flagged))
+    body = {"entries": entries, "next_cursor": next_cursor}
+    if since is not None:
+        #where to poll from next time (unchanged if nothing new arrived)
+        body["since"] = encode_cursor(entries[-1]) if entries else args.get("since")
+
+    response = jsonify(body)
+    response.set_etag(etag)
+    return response, 200
+
+#builds the filter for /get-data and /search, None when there is nothing to filter on
+def entry_filter(tag=None, parent_id=None, flagged=None, sentiment=None):
+    checks = []
+    if tag:
+        checks.append(lambda entry: tag_index.has(tag, entry["id"]))
+    if parent_id:
+        parent = None if parent_id.lower() == "none" else parent_id
+        checks.append(lambda entry: entry.get("parent_id") == parent)
+    if flagged is not None:
+        wanted = flagged.lower() in ("1", "true", "yes")
+        def check_flagged(entry):
+            logged = log_store.get(entry["id"])
+            return logged is not None and bool(logged.get("flagged")) == wanted
+        checks.append(check_flagged)
+    if sentiment:
+        def check_sentiment(entry):
+            logged = log_store.get(entry["id"])
+            return logged is not None and str(logged.get("sentiment")).lower() == sentiment.lower()
+        checks.append(check_sentiment)
+
+    if not checks:
+        return None
+    return lambda entry: all(check(entry) for check in checks)
+
+#full-text search over titles, texts and tags, best match first (search_index.py), query parameters:
+#   q          the words to look for, "word*" matches every word starting with "word"
+#   prefix     true: the last word is a prefix too (search as you type)
+#   tag, parent_id, flagged (true/false), sentiment filters
+#   offset, limit   pagination (limit default 20, at most 500)
+@app.route("/search", methods=["GET"])
+def search():
+    args = request.args
+    query = args.get("q", "")
+    offset = max(args.get("offset", 0, type=int), 0)
+    limit = min(max(args.get("limit", 20, type=int), 1), MAX_LIMIT)
+    prefix = args.get("prefix", "").lower() in ("1", "true", "yes")
+
+    filtered = args.get("flagged") is not None or args.get("sentiment")
+    versions = (DATA.version, log_store.version if filtered else 0)
+    etag = hashlib.sha1(f"search|{versions}|{sorted(args.items())}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    match = entry_filter(args.get("tag"), args.get("parent_id"), args.get("flagged"), args.get("sentiment"))
+    total, hits = search_index.search(query, prefix=prefix, match=match, offset=offset, limit=limit)
+    response = jsonify({
+        "query": query, "total": total, "offset": offset, "limit": limit,
+        "results": [{**entry, "score": round(score, 4)} for score, entry in hits]
+    })
+    response.set_etag(etag)
+    return response, 200
+
+#tags with the number of entries carrying each one
+@app.route("/tags", methods=["GET"])
+def get_tags():
+    return jsonify(tag_index.counts()), 200
+
+#entries for one tag, newest first, paginated with ?offset=&limit=
+@app.route("/tags/<tag>", methods=["GET"])
+def get_tag_entries(tag):
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 500)
+    total, entries = tag_index.page(tag, offset, limit)
+    return jsonify({"tag": tag, "total": total, "offset": offset, "limit": limit, "entries": entries}), 200
+
+#dashboard data as compact json (sentiment, flags, reasons, keywords, wordcloud, topics)
+#   keywords?limit=, wordcloud?limit=&reason=, topics?terms=
+#results are cached until the content log changes and unchanged ones are answered with a 304
+@app.route("/analytics", methods=["GET"])
+def list_analytics():
+    return jsonify({name: {"params": {param: default for param, (default, _) in params.items()},
+                           "png": f"/analytics/{name}/png"}
+                    for name, (_, params) in DATASETS.items()}), 200
+
+@app.route("/analytics/<name>", methods=["GET"])
+def get_analytics(name):
+    if name not in DATASETS:
+        return jsonify({"error": f"unknown dataset: {name}"}), 404
+    params = parse_params(name, request.args)
+
+    etag = analytics_cache.etag(name, params)
+    if etag in request.if_none_match:
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    etag, payload = analytics_cache.get(name, params)
+    response = Response(payload, mimetype="application/json")
+    response.set_etag(etag)
+    return response, 200
+
+#the same data drawn as a png, rendered on demand (only if its data changed since the last drawing),
+#with serve.py the refresher's last drawing
+@app.route("/analytics/<name>/png", methods=["GET"])
+def get_analytics_png(name):
+    if name not in CHART_FILES:
+        return jsonify({"error": f"unknown chart: {name}"}), 404
+    output_name = CHART_FILES[name]
+    render_scheduler.refresh(names=[output_name])
+    if not os.path.exists(os.path.join(STATIC_PATH, output_name)):
+        return jsonify({"error": "nothing to draw yet"}), 404
+    return send_from_directory(os.path.abspath(STATIC_PATH), output_name, max_age=0)
 
 @app.route('/submit', methods=['POST'])
 #function for getting user text input 
@@ -71,76 +207,209 @@ def submit_entry():
     else: 
         tags_list = []
 
-    #perform analysis of sentiment and toxicity for potential flagging 
-    analysis = analyze(text)
-    #catch flagged words, gets a list of flagged words 
-    flags = flag(text) 
-    print(flags)
-    is_flagged = bool(flags or analysis['sentiment'] == 'NEGATIVE' or analysis['toxicity'] == 'toxic')
-
-
     #initalize a new json entry object 
     #id points to the unique id of each post 
     #parent_id identifies traces of replies, but some entries may not have a parent id 
-    new_entry = {
+    raw_entry = {
         "timestamp": datetime.now().isoformat(),  #create a timestamp when submitted
-        'id': str(uuid.uuid4()), #creating unique ID
-        "title": title, 
-        "text": text,
-        "tags": tags_list, 
-        'parent_id': parent_id, 
-        'sentiment': analysis['sentiment'], 
-        'toxicity': analysis['toxicity'], 
-        'keywords': flags, 
-        'flagged': is_flagged
-    }
-
-    #specify reasons for flagging here, returns empty list if nothing is flagged 
-    reasons = []
-    if new_entry['keywords'] or new_entry['toxicity']=='TOXIC' or new_entry['sentiment']=='NEGATIVE':
-            reasons = []
-            if new_entry['keywords']:
-                reasons.append('KEYWORD: ' + ", ".join(new_entry['keywords']))
-            if new_entry['sentiment']=='NEGATIVE':
-                reasons.append('SENTIMENT: '+ new_entry['sentiment']) 
-            if new_entry['toxicity'] == 'TOXIC':
-                reasons.append('TOXICITY: '+ new_entry['toxicity'])
-
-
-    #log RAW data in user-text.json
-    stored_data = read_data()
-    #add the user input to the json file 
-    stored_data.append({
-        "timestamp": new_entry["timestamp"],
-        "id": new_entry["id"],
+        "id": str(uuid.uuid4()), #creating unique ID
         "title": title,
         "text": text,
         "tags": tags_list,
         "parent_id": parent_id
-    })
-    write_data(stored_data)
+    }
+
+    #log RAW data in user-text.jsonl
+    write_data([raw_entry])
 
-    #finally, create a log that includes all details about flags  
-    log_content(new_entry, reasons)
+    #sentiment/toxicity/keyword flagging, the content log and the admin dashboard 
+    #are updated in the background, progress can be checked at /status/<id>
+    pipeline.enqueue(raw_entry)
 
-    #then, run analyis from updated data and display in the admin dashboard 
-    run_analysis()
     #display feedback that user entered 
-    return jsonify({"message": "Entry saved."}), 200
+    return jsonify({"message": "Entry saved.", "id": raw_entry["id"], "state": "queued"}), 202
+
+#reports where an entry is in the moderation pipeline 
+@app.route('/status/<entry_id>', methods=['GET'])
+def entry_status(entry_id):
+    status = pipeline.status(entry_id)
+    if status:
+        return jsonify({"id": entry_id, **status}), 200
+
+    #finished, or not handled by this process (e.g. before a restart), fall back to what is stored
+    if entry_id in log_store:
+        return jsonify({"id": entry_id, "state": "done"}), 200
+    if entry_id in DATA:
+        return jsonify({"id": entry_id, "state": "pending"}), 200
+    return jsonify({"error": "unknown entry id"}), 404
+
+#re-queue raw entries that were saved but never moderated, e.g. when the server stopped mid-pipeline
+def recover_pending():
+    pending = [entry for entry in read_data() if entry["id"] not in log_store]
+    for entry in pending:
+        pipeline.enqueue(entry)
+    return len(pending)
+
+#checking which models are loaded, and unloading/reloading them without restarting the server
+#unload/reload need the ADMIN_TOKEN (in an X-Admin-Token header) and are off when it isn't set:
+#CORS is open to the frontend, so any page could otherwise post to them
+#with serve.py every web worker holds its own models, the call reaches the one that answers it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def admin_denied():
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "admin token required"}), 403
+    return None
+
+@app.route('/models', methods=['GET'])
+def model_status():
+    return jsonify(registry.status()), 200
+
+@app.route('/models/reload', methods=['POST'])
+def reload_models():
+    denied = admin_denied()
+    if denied:
+        return denied
+    name = (request.get_json(silent=True) or {}).get("name")
+    try:
+        load_times = registry.reload(name)
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"message": "Models reloaded.", "load_seconds": load_times}), 200
+
+@app.route('/models/unload', methods=['POST'])
+def unload_models():
+    denied = admin_denied()
+    if denied:
+        return denied
+    name = (request.get_json(silent=True) or {}).get("name")
+    registry.unload(name)
+    return jsonify({"message": "Models unloaded."}), 200
+
+@app.route('/batch-metrics', methods=['GET'])
+def batch_metrics():
+    return jsonify(scheduler.metrics()), 200
+
+@app.route('/render-metrics', methods=['GET'])
+def render_metrics():
+    return jsonify(render_scheduler.metrics()), 200
+
+#classification/keyword cache hit rates and the inference time they saved
+@app.route('/cache-metrics', methods=['GET'])
+def cache_metrics():
+    return jsonify({"classification": classification_cache.metrics(), "clean": cache_stats()}), 200
+
+@app.route('/analytics-metrics', methods=['GET'])
+def analytics_metrics():
+    return jsonify(analytics_cache.metrics()), 200
+
+#heavy libraries and the subsystem that pulls each of them in, nothing imports them at startup
+LAZY_LIBRARIES = {
+    "transformers": "models",
+    "sklearn": "text cleaning / topic model",
+    "matplotlib": "charts",
+    "pandas": "dashboard data",
+    "pyarrow": "analytics snapshot",
+    "wordcloud": "wordcloud",
+}
+warm_up_thread = None
+
+#which subsystems are warm, reads of the stores never wait for any of the others
+#?require=models,topic_model answers 503 until those are warm (e.g. for a load balancer check)
+@app.route('/ready', methods=['GET'])
+def ready():
+    models = registry.status()
+    subsystems = {
+        "raw_store": raw_store.loaded,
+        "log_store": log_store.loaded,
+        "models": bool(models) and all(model["loaded"] for model in models.values()),
+        "classification_cache": classification_cache.loaded,
+        "topic_model": topic_engine.model_loaded,
+    }
+    required = [name for name in request.args.get("require", "").split(",") if name]
+    unknown = [name for name in required if name not in subsystems]
+    if unknown:
+        return jsonify({"error": f"unknown subsystem: {', '.join(unknown)}"}), 400
+    body = {
+        "ready": all(subsystems[name] for name in required),
+        "warming_up": warm_up_thread is not None and warm_up_thread.is_alive(),
+        "subsystems": subsystems,
+        "models": {name: model["loaded"] for name, model in models.items()},
+        "libraries": {name: {"loaded": name in sys.modules, "used_by": used_by}
+                      for name, used_by in LAZY_LIBRARIES.items()},
+    }
+    return jsonify(body), 200 if body["ready"] else 503
+
+#loads both classifiers and re-queues unmoderated entries while the server already answers,
+#a /submit arriving meanwhile just waits for the models in the background pipeline
+def warm_up():
+    log.info("Warming up models: %s", registry.warm_up())
+    log.info("Re-queued unmoderated entries: %d", recover_pending())
+
+#request latency for every endpoint, plus an optional cProfile of a sample of the requests:
+#PROFILE_SAMPLE_RATE=0.01 profiles 1% of them, each profile is written to PROFILE_DIR as
+#<time>-<endpoint>.prof (open with python -m pstats or snakeviz)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+REQUEST_SECONDS = metrics.histogram("http_request_seconds", "Seconds to answer a request",
+                                    ["endpoint", "method", "status"])
+PROFILED = metrics.counter("profiled_requests_total", "Requests run under cProfile", ["endpoint"])
+
+@app.before_request
+def start_request():
+    g.started = perf_counter()
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            #another request's profiler is running (only one at a time from python 3.12)
+            return
+        g.profiler = profiler
+
+@app.after_request
+def finish_request(response):
+    endpoint = request.endpoint or "unknown"
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{endpoint}.prof"))
+            PROFILED.inc(endpoint=endpoint)
+        except OSError as e:
+            log.warning("Could not write request profile: %s", e)
+    if "started" in g:
+        REQUEST_SECONDS.observe(perf_counter() - g.started, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+    return response
+
+#sizes of the stores, read at scrape time (a store nobody has used yet is not loaded for this)
+def store_entries():
+    return {(name,): len(store) for name, store in (("raw", raw_store), ("log", log_store)) if store.loaded}
 
-#creating a dictionary to map each tag to unique IDs that contain them
-def build_tag_dict(entries):
-    tag_dict = {}
-    #iterate through each entry and map tags into the dict, do nothing when 
-    #user enters no tags 
-    for entry in entries: 
-        for tag in entry.get("tags", []): 
-            if tag not in tag_dict: 
-                tag_dict[tag] = [] #creeate a new list when a new tag appears
-            tag_dict[tag].append(entry["id"])
+def store_bytes():
+    sizes = {}
+    for name, store in (("raw", raw_store), ("log", log_store)):
+        try:
+            sizes[(name,)] = os.path.getsize(store.path)
+        except OSError:
+            pass
+    return sizes
 
-    return tag_dict
+metrics.gauge("store_entries", "Live entries per store", ["store"], collect=store_entries)
+metrics.gauge("store_log_bytes", "Size of each store's log file", ["store"], collect=store_bytes)
+metrics.gauge("classification_cache_entries", "Results held by the classification cache",
+              collect=lambda: {(): classification_cache.metrics()["size"]})
+metrics.gauge("models_loaded", "Whether each model is loaded", ["model"],
+              collect=lambda: {(name,): int(model["loaded"]) for name, model in registry.status().items()})
 
+#prometheus text format: stage latencies of /submit, flagged/errored classifications, chart
+#renders, request latencies and store sizes of this process
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/')
 def user_view():
@@ -150,5 +419,13 @@ def user_view():
 def admin_view():
     return render_template('admin.astro')
 
+#development server, one process (serve.py runs several workers that share the models)
 if __name__ == '__main__':
+    #LOG_LEVEL=DEBUG shows raw model outputs and the other debug details, off by default
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    #with debug=True the reloader starts a second process, only warm up the one that serves
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+        warm_up_thread.start()
     app.run(debug=True, port=5050)
\ No newline at end of file
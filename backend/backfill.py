@@ -0,0 +1,198 @@
+#bulk (re)classification of stored entries into the content log, e.g. after a model or
+#moderation list change, instead of one /submit at a time
+#   python backfill.py [source] [--workers N] [--batch-size N] [--restart] [--no-cache]
+#source: the raw entry store (default, user-text.jsonl), user-text.json, a csv export like
+#data_file.csv, the legacy per-flag log content_log.json or any other stored json/jsonl file
+#entries are classified in large batches across worker processes and streamed into a new log
+#file that replaces content_log_cleaned.jsonl at the end, progress is checkpointed after every
+#batch so an interrupted run continues where it stopped (unless --restart is given)
+#--no-cache classifies every text again instead of reusing results from the classification cache
+import argparse
+import ast
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
+
+from entry_store import log_store, raw_store, atomic_write_json
+from entry_reader import iter_entries
+from process_local import cpu_count
+
+BATCH_SIZE = 256
+CHECKPOINT = "backfill_checkpoint.json"
+#the raw fields of an entry, everything else is recomputed
+RAW_FIELDS = ("timestamp", "id", "title", "text", "tags", "parent_id")
+
+#sources, each yields raw entries ({timestamp, id, title, text, tags, parent_id})
+def raw_fields(entry):
+    return {field: entry.get(field) for field in RAW_FIELDS}
+
+def csv_value(value):
+    #the csv export writes python reprs: None, [], ['a', 'b']
+    if value in ("", "None", "nan"):
+        return None
+    if value.startswith("["):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            entry = {field: csv_value(row.get(field) or "") for field in RAW_FIELDS}
+            entry["tags"] = entry["tags"] or []
+            yield entry
+
+def iter_source(source):
+    if source in (None, "store", raw_store.path):
+        entries = raw_store.entries()
+    elif source.endswith(".csv"):
+        entries = read_csv(source)
+    else:
+        #user-text.json, content_log.json, store logs... streamed (entry_reader.py)
+        entries = iter_entries(source)
+    for entry in entries:
+        if entry.get("id") and isinstance(entry.get("text"), str):
+            yield raw_fields(entry)
+
+def batches(entries, size):
+    while True:
+        batch = list(islice(entries, size))
+        if not batch:
+            return
+        yield batch
+
+#runs in the worker processes: one batch through both models and the keyword matcher
+def classify_batch(raw_entries, use_cache=True):
+    from classification_cache import classification_cache
+    from sentimental_analysis import analyze_sentiment_toxicity_batch, flag_keywords_batch
+    from moderation_jobs import moderation_record
+    from log_moderation import log_record
+
+    classification_cache.bypass = not use_cache
+    texts = [entry["text"] for entry in raw_entries]
+    analyses = analyze_sentiment_toxicity_batch(texts)
+    flags = flag_keywords_batch(texts)
+    return [log_record(*moderation_record(entry, analysis, keywords))
+            for entry, analysis, keywords in zip(raw_entries, analyses, flags)]
+
+def classify_all(raw_batches, workers, use_cache=True):
+    '''Classified batches in source order, at most 2 batches per worker in flight'''
+    if workers <= 1:
+        for batch in raw_batches:
+            yield classify_batch(batch, use_cache)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+        for batch in raw_batches:
+            pending.append(pool.submit(classify_batch, batch, use_cache))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+#checkpoints: how long the output file was after the last batch, the entries in it are skipped
+#(by id) when the run is resumed
+def load_checkpoint(path, source, output):
+    try:
+        with open(path, "r") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if checkpoint.get("source") != source or checkpoint.get("output") != output or not os.path.exists(output):
+        return None
+    return checkpoint
+
+def written_ids(output, size):
+    ids = set()
+    with open(output, "rb") as f:
+        for line in f.read(size).splitlines():
+            record = json.loads(line)
+            ids.update(entry["id"] for entry in record.get("entries", []))
+    return ids
+
+def backfill(source=None, workers=None, batch_size=BATCH_SIZE, restart=False, checkpoint_path=CHECKPOINT,
+             use_cache=True):
+    workers = cpu_count() if workers is None else workers
+    source_name = source or "store"
+    output = log_store.path + ".backfill"
+
+    checkpoint = None if restart else load_checkpoint(checkpoint_path, source_name, output)
+    if checkpoint:
+        #drop anything written after the last checkpoint and skip what is already done
+        with open(output, "r+b") as f:
+            f.truncate(checkpoint["offset"])
+        seq = checkpoint["seq"]
+        ids = written_ids(output, checkpoint["offset"])
+        print(f"Resuming {source_name} after {len(ids)} entries")
+    else:
+        #the new log starts above the current seq, so every index sees it as newer and rebuilds
+        seq, ids = log_store.version + 1, set()
+        with open(output, "w") as f:
+            f.write(json.dumps({"seq": seq, "op": "meta"}) + "\n")
+
+    #by id, not by position: the source may have changed since the interrupted run
+    entries = (entry for entry in iter_source(source) if entry["id"] not in ids)
+    t0 = perf_counter()
+    classified = 0
+    with open(output, "ab") as f:
+        for records in classify_all(batches(entries, batch_size), workers, use_cache):
+            f.write((json.dumps({"seq": seq, "op": "put", "entries": records}) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            ids.update(record["id"] for record in records)
+            classified += len(records)
+            atomic_write_json(checkpoint_path, {"source": source_name, "output": output, "offset": f.tell(),
+                                                "seq": seq})
+            elapsed = perf_counter() - t0
+            print(f"{len(ids)} entries ({classified / elapsed:.1f}/s)")
+
+    live = swap_in(output, ids)
+    os.remove(checkpoint_path)
+    print(f"Rebuilt {log_store.path}: {live} entries from {source_name} in {perf_counter() - t0:.1f}s")
+    return live
+
+def swap_in(output, ids):
+    #with the log locked: carry over the entries the source didn't cover (including anything
+    #submitted while the backfill ran), then replace the log, readers see the old one unlinked and reload
+    #the log only describes stored entries: whatever isn't in the raw store (e.g. deleted while the
+    #backfill ran, delete_data.py removes it there first) is deleted again in the new log
+    with log_store._locked():
+        stored = set(raw_store.ids())
+        with log_store.reading():
+            carried = [entry for entry in log_store.entries() if entry["id"] not in ids and entry["id"] in stored]
+            seq = log_store.version + 1
+        deleted = [entry_id for entry_id in ids if entry_id not in stored]
+        with open(output, "a") as f:
+            f.write(json.dumps({"seq": seq, "op": "meta"}) + "\n")
+            if carried:
+                f.write(json.dumps({"seq": seq, "op": "put", "entries": carried}) + "\n")
+            if deleted:
+                f.write(json.dumps({"seq": seq + 1, "op": "del", "ids": deleted}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(output, log_store.path)
+        log_store.entries() #reload now, so our own indexes are rebuilt and saved before we exit
+        return len(ids) - len(deleted)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run moderation over stored entries")
+    parser.add_argument("source", nargs="?", default=None,
+                        help="user-text.json, a .csv export, content_log.json or a .jsonl store (default: the raw store)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per cpu, 1 = no pool)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--no-cache", action="store_true", help="don't reuse results from the classification cache")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.source and not os.path.exists(args.source):
+        sys.exit(f"No such file: {args.source}")
+    backfill(args.source, args.workers, args.batch_size, args.restart, use_cache=not args.no_cache)
@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from time import monotonic
+
+from process_local import daemon_thread
+from sentimental_analysis import analyze_sentiment_toxicity_batch, cached_analysis
+
+#how long the first text in a batch may wait for others to join, and the largest batch
+#one forward pass will take
+MAX_WAIT = float(os.environ.get("BATCH_MAX_WAIT", "0.02"))
+MAX_BATCH_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+
+#micro-batching scheduler: callers hand in one text each, a single worker thread groups
+#whatever arrives within MAX_WAIT into one batch, runs it, and resolves each caller's future
+class BatchScheduler:
+    def __init__(self, batch_fn, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._worker = daemon_thread(self._run, "batch-scheduler")
+
+        #metrics
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+
+    def submit(self, text):
+        '''Queue one text and return a Future that resolves to its own result'''
+        future = Future()
+        with self._cond:
+            self._worker.get()
+            self._queue.append((text, future, monotonic()))
+            self._cond.notify()
+        return future
+
+    def __call__(self, text):
+        return self.submit(text).result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            #the oldest text decides the deadline, others only join until then
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for text, _, _ in batch]
+
+            started = monotonic()
+            self._record(batch, started)
+            try:
+                results = self.batch_fn(texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, batch, started):
+        with self._cond:
+            self._batches += 1
+            self._items += len(batch)
+            self._largest_batch = max(self._largest_batch, len(batch))
+            for _, _, queued in batch:
+                wait = started - queued
+                self._total_wait += wait
+                self._max_wait_seen = max(self._max_wait_seen, wait)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "mean_wait_s": self._total_wait / self._items if self._items else 0.0,
+                "max_wait_s": self._max_wait_seen,
+            }
+
+
+#shared scheduler in front of analyze_sentiment_toxicity
+scheduler = BatchScheduler(analyze_sentiment_toxicity_batch)
+
+def analyze_async(text):
+    '''Future of the analysis of one text, resolved by the batch worker without blocking the caller'''
+    #a text that was classified before (e.g. a duplicate submission) skips the queue and the models
+    cached = cached_analysis(text)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+    return scheduler.submit(text)
+
+def analyze(text):
+    return analyze_async(text).result()
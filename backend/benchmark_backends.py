@@ -0,0 +1,100 @@
+#benchmark and accuracy-parity check for the inference backends (inference_backends.py)
+#every backend runs both moderation models over the stored corpus in its own process, so load
+#time, latency, throughput and resident memory are measured without the others in memory,
+#and its labels are compared with those of the full precision torch backend
+#run from the backend folder: python benchmark_backends.py [number_of_texts] [backend ...]
+#exits with status 1 when a backend agrees with torch on fewer than PARITY_THRESHOLD of the labels
+#a backend whose dependencies are missing (it would run on torch instead) is reported as skipped
+import json
+import multiprocessing
+import os
+import resource
+import sys
+from time import perf_counter
+
+from inference_backends import BACKENDS
+
+PARITY_THRESHOLD = 0.95
+BATCH_SIZE = 16
+
+def resident_mb():
+    #current resident set size, from /proc on linux, else the peak so far
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_backend(backend, texts):
+    from sentimental_analysis import (get_sentiment_classifier, get_toxicity_classifier, label_texts,
+                                      sentiment_aggregate, toxicity_aggregate)
+
+    models = {"sentiment": (get_sentiment_classifier, sentiment_aggregate),
+              "toxicity": (get_toxicity_classifier, toxicity_aggregate)}
+    results = {"backend": backend, "texts": len(texts), "models": {}}
+    rss_start = resident_mb()
+    for name, (loader, aggregate) in models.items():
+        t0 = perf_counter()
+        classifier, loaded = loader(backend)
+        load_s = perf_counter() - t0
+        if loaded != backend:
+            return {"backend": backend, "skipped": f"unavailable, {name} loaded on {loaded}"}
+        label_texts(classifier, texts[:1], aggregate, name) #warm up
+
+        labels = []
+        t0 = perf_counter()
+        for start in range(0, len(texts), BATCH_SIZE):
+            labels.extend(label_texts(classifier, texts[start:start + BATCH_SIZE], aggregate, name))
+        elapsed = perf_counter() - t0
+        results["models"][name] = {
+            "load_s": round(load_s, 3),
+            "ms_per_text": round(1000 * elapsed / len(texts), 2),
+            "texts_per_s": round(len(texts) / elapsed, 2),
+            "labels": labels
+        }
+    results["resident_mb"] = round(resident_mb() - rss_start, 1)
+    return results
+
+def benchmark(n=200, backends=BACKENDS):
+    from benchmark_models import sample_texts
+
+    texts = sample_texts(n)
+    backends = ["torch"] + [backend for backend in backends if backend != "torch"]
+    #a fresh process per backend, so memory and thread pools are not shared between them
+    context = multiprocessing.get_context("spawn")
+    runs = {}
+    for backend in backends:
+        with context.Pool(1) as pool:
+            runs[backend] = pool.apply(run_backend, (backend, texts))
+
+    reference = runs["torch"]["models"]
+    report = {}
+    for backend, run in runs.items():
+        if "skipped" in run:
+            report[backend] = {"skipped": run["skipped"]}
+            continue
+        report[backend] = {"resident_mb": run["resident_mb"], "models": {}}
+        for name, model in run["models"].items():
+            expected = reference[name]["labels"]
+            agreement = sum(a == b for a, b in zip(model["labels"], expected)) / max(len(expected), 1)
+            report[backend]["models"][name] = {
+                **{key: value for key, value in model.items() if key != "labels"},
+                "agreement": round(agreement, 4),
+                "speedup": round(reference[name]["ms_per_text"] / model["ms_per_text"], 2)
+            }
+    return report
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    backends = sys.argv[2:] or BACKENDS
+    report = benchmark(n, backends)
+    print(json.dumps(report, indent=2))
+
+    skipped = [backend for backend, result in report.items() if "skipped" in result]
+    if skipped:
+        print(f"[!] Skipped, dependencies missing: {', '.join(skipped)}")
+    failed = [f"{backend}/{name}" for backend, result in report.items()
+              for name, model in result.get("models", {}).items() if model["agreement"] < PARITY_THRESHOLD]
+    if failed:
+        print(f"[!] Below {PARITY_THRESHOLD:.0%} label agreement with torch: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,84 @@
+#benchmark for the model registry: how long does one submission take when the models
+#have to be built first (cold) versus when they are already loaded (warm)
+#it also measures throughput of the batching scheduler when many submits arrive at once
+#run from the backend folder: python benchmark_models.py [number_of_texts]
+#the classification cache is bypassed (models are called directly) and every run gets texts of its
+#own, otherwise everything after the first run would only measure cache hits
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from statistics import mean, median
+
+from model_registry import registry
+from entry_store import raw_store
+from sentimental_analysis import run_pipeline, sentiment_aggregate, toxicity_aggregate
+from synthetic_archive import ArchiveGenerator
+from batching import BatchScheduler
+
+def sample_texts(n):
+    '''n different texts, the archive's first and then synthetic ones'''
+    texts = list(dict.fromkeys(entry["text"] for entry in raw_store.entries() if entry.get("text")))[:n]
+    seen = set(texts)
+    generator = ArchiveGenerator(seed=1)
+    while len(texts) < n:
+        text = generator.text()
+        if text not in seen:
+            seen.add(text)
+            texts.append(text)
+    return texts
+
+def analyze_uncached(texts):
+    #analyze_sentiment_toxicity_batch without the classification cache
+    sentiments = run_pipeline("sentiment", texts, sentiment_aggregate)
+    toxicities = run_pipeline("toxicity", texts, toxicity_aggregate)
+    return [{'sentiment': s, 'toxicity': t} for s, t in zip(sentiments, toxicities)]
+
+def run_benchmark(n=20):
+    texts = sample_texts(n + 1)
+
+    #cold: drop everything so the first call has to rebuild tokenizers and models
+    registry.unload()
+    t0 = perf_counter()
+    analyze_uncached(texts[:1])
+    cold = perf_counter() - t0
+
+    #warm: the same registry objects are reused for every call
+    warm = []
+    for text in texts[1:]:
+        t0 = perf_counter()
+        analyze_uncached([text])
+        warm.append(perf_counter() - t0)
+
+    results = {
+        "texts": len(warm),
+        "cold_first_submission_s": round(cold, 4),
+        "warm_mean_s": round(mean(warm), 4),
+        "warm_median_s": round(median(warm), 4),
+        "warm_max_s": round(max(warm), 4),
+        "model_load_s": {name: info["load_seconds"] for name, info in registry.status().items()},
+    }
+    return results
+
+def run_concurrent_benchmark(n=64, batch_sizes=(1, 4, 16, 32)):
+    #simulate a burst of n simultaneous submits against schedulers with different batch sizes
+    samples = sample_texts(n * len(batch_sizes))
+    registry.warm_up()
+    results = {}
+    for i, size in enumerate(batch_sizes):
+        texts = samples[i * n:(i + 1) * n]
+        scheduler = BatchScheduler(analyze_uncached, max_batch_size=size)
+        t0 = perf_counter()
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            list(pool.map(scheduler, texts))
+        elapsed = perf_counter() - t0
+        results[size] = {
+            "texts_per_s": round(n / elapsed, 2),
+            "metrics": scheduler.metrics()
+        }
+    return results
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(json.dumps(run_benchmark(n), indent=2))
+    print(json.dumps(run_concurrent_benchmark(max(n, 32)), indent=2))
@@ -0,0 +1,174 @@
+#serving benchmark for serve.py: submit throughput, moderation throughput and memory with 1..N
+#web workers, against a synthetic archive (synthetic_archive.py) so the real data is never touched
+#   python benchmark_serving.py [--workers 1 2 4] [--requests 200] [--concurrency 16] [--entries 1000]
+#for every worker count the server starts in a fresh copy of the archive, the client threads post
+#--requests entries, then the benchmark waits until every one of them is in the content log and
+#checks none is missing from either store
+#memory is the proportional set size (pss) summed over the server's processes: a page shared by
+#n processes counts 1/n for each, so models shared copy-on-write are counted once
+#exits with status 1 when an entry was lost
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
+from entry_store import EntryStore
+from keyword_matcher import MODERATION_LIST
+
+WORKERS = (1, 2, 4)
+REQUESTS = 200
+CONCURRENCY = 16
+ENTRIES = 1000
+RESULTS = "benchmark_serving.json"
+#model loading included, the first start may download them
+STARTUP_TIMEOUT = 900
+MODERATION_TIMEOUT = 600
+SERVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def request(url, body=None, timeout=60):
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+def wait_ready(url, server):
+    deadline = perf_counter() + STARTUP_TIMEOUT
+    while perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            if request(url + "/ready?require=models", timeout=5)[0] == 200:
+                return
+        except OSError:
+            pass #not listening yet
+        sleep(0.5)
+    raise RuntimeError("server did not become ready")
+
+def descendants(pid):
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f:
+                #pid (comm) state ppid ..., comm may contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    found, queue = [], [pid]
+    while queue:
+        current = queue.pop()
+        found.append(current)
+        queue.extend(children.get(current, []))
+    return found
+
+def pss_mb(pid):
+    '''(total, per process) pss in MB of a process and everything it started'''
+    per_process = {}
+    for child in descendants(pid):
+        try:
+            with open(f"/proc/{child}/smaps_rollup", "r") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        per_process[child] = int(line.split()[1]) / 1024
+                        break
+        except OSError:
+            continue
+    return round(sum(per_process.values()), 1), {str(p): round(mb, 1) for p, mb in per_process.items()}
+
+def run(workers, n_requests, concurrency, entries, seed=0):
+    from synthetic_archive import ArchiveGenerator, write_archive
+
+    #texts the archive doesn't have, so none of them is answered from the classification cache
+    generator = ArchiveGenerator(seed + 1)
+    texts = [generator.text() for _ in range(n_requests)]
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "backend")
+        os.makedirs(os.path.join(tmp, "public", "static"))
+        write_archive(directory, entries, seed)
+        shutil.copy(MODERATION_LIST, directory)
+        #read like any other process would while the server appends
+        raw_store = EntryStore(os.path.join(directory, "user-text.jsonl"))
+        log_store = EntryStore(os.path.join(directory, "content_log_cleaned.jsonl"))
+
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen([sys.executable, SERVE, "--workers", str(workers), "--port", str(port)], cwd=directory)
+        try:
+            t0 = perf_counter()
+            wait_ready(url, server)
+            startup = perf_counter() - t0
+            idle_mb, _ = pss_mb(server.pid)
+
+            def submit(i):
+                status, body = request(url + "/submit", {"title": f"benchmark {i}", "text": texts[i], "tags": "benchmark"})
+                return body["id"] if status == 202 else None
+
+            t0 = perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                ids = list(pool.map(submit, range(n_requests)))
+            submitted = perf_counter() - t0
+            accepted = {entry_id for entry_id in ids if entry_id}
+
+            deadline = perf_counter() + MODERATION_TIMEOUT
+            while perf_counter() < deadline and not accepted <= set(log_store.ids()):
+                sleep(0.1)
+            moderated = perf_counter() - t0
+            busy_mb, per_process = pss_mb(server.pid)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(60)
+
+        #after a clean stop everything accepted must be in both stores
+        missing_raw = accepted - set(raw_store.ids())
+        missing_log = accepted - set(log_store.ids())
+    return {
+        "workers": workers,
+        "startup_s": round(startup, 2),
+        "requests": n_requests,
+        "accepted": len(accepted),
+        "submit_per_s": round(len(accepted) / submitted, 1),
+        "moderated_per_s": round(len(accepted) / moderated, 1),
+        "lost": len(missing_raw | missing_log),
+        "pss_idle_mb": idle_mb,
+        "pss_mb": busy_mb,
+        "pss_per_process_mb": per_process,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and memory of serve.py with several worker counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=list(WORKERS))
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--entries", type=int, default=ENTRIES, help="size of the synthetic archive")
+    parser.add_argument("--output", default=RESULTS)
+    args = parser.parse_args()
+
+    results = [run(n, args.requests, args.concurrency, args.entries) for n in args.workers]
+    with open(args.output, "w") as f:
+        json.dump({"cpus": os.cpu_count(), "runs": results}, f, indent=2)
+    print(f"{'workers':>8} {'submit/s':>10} {'moderated/s':>12} {'pss MB':>10} {'idle MB':>10} {'lost':>6}")
+    for result in results:
+        print(f"{result['workers']:>8} {result['submit_per_s']:>10} {result['moderated_per_s']:>12} "
+              f"{result['pss_mb']:>10} {result['pss_idle_mb']:>10} {result['lost']:>6}")
+    if any(result["lost"] for result in results):
+        print("[!] Entries were lost")
+        sys.exit(1)
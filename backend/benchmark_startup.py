@@ -0,0 +1,109 @@
+#startup benchmark: what it costs to import the server and how soon it answers a read-only request
+#   python benchmark_startup.py [runs] [--top N] [--budget SECONDS]
+#1. `python -X importtime` of app.py and delete_data.py in a fresh interpreter, their slowest imports
+#2. a fresh interpreter imports app and answers READ_PATHS through flask's test client, timed from
+#   the moment the process was launched, and the heavy libraries (app.LAZY_LIBRARIES) it loaded
+#run from the backend folder, exits with status 1 when the first request takes longer than the
+#budget or a read-only request pulls in one of the heavy libraries
+import argparse
+import json
+import subprocess
+import sys
+from statistics import median
+from time import time
+
+MODULES = ("app", "delete_data")
+READ_PATHS = ("/get-data?limit=20", "/tags", "/analytics/sentiment", "/ready")
+BUDGET = 1.0
+
+FIRST_REQUEST = """
+import json, sys, time
+t0 = time.time()
+import app
+imported = time.time()
+client = app.app.test_client()
+requests = []
+for path in %r:
+    t = time.time()
+    status = client.get(path).status_code
+    requests.append({"path": path, "status": status, "seconds": time.time() - t})
+    if len(requests) == 1:
+        first = time.time()
+print(json.dumps({"started": t0, "imported": imported, "first_response": first, "requests": requests,
+                  "libraries": [name for name in app.LAZY_LIBRARIES if name in sys.modules]}))
+"""
+
+def parse_importtime(stderr):
+    '''(module, self seconds, cumulative seconds, depth) for each line of -X importtime output'''
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return imports
+
+def import_profile(module, top=10):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    imports = parse_importtime(result.stderr)
+    total = next(cumulative for name, _, cumulative, depth in imports if name == module and depth == 0)
+    #the module's own imports, each with everything it pulled in
+    by_cumulative = sorted((entry for entry in imports if entry[3] == 1), key=lambda entry: -entry[2])
+    return {
+        "seconds": round(total, 3),
+        "modules": len(imports),
+        "slowest": [{"module": name, "cumulative_s": round(cumulative, 3), "self_s": round(own, 3)}
+                    for name, own, cumulative, _ in by_cumulative[:top]],
+    }
+
+def first_request():
+    launched = time()
+    result = subprocess.run([sys.executable, "-c", FIRST_REQUEST % (READ_PATHS,)], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"first request failed:\n{result.stderr[-2000:]}")
+    run = json.loads(result.stdout.strip().splitlines()[-1])
+    return {
+        "interpreter_s": run["started"] - launched,
+        "import_s": run["imported"] - run["started"],
+        "first_response_s": run["first_response"] - launched,
+        "requests": run["requests"],
+        "libraries": run["libraries"],
+    }
+
+def benchmark(runs=3, top=10):
+    report = {"imports": {module: import_profile(module, top) for module in MODULES}}
+    first = [first_request() for _ in range(runs)]
+    report["first_request"] = {
+        "runs": runs,
+        **{key: round(median(run[key] for run in first), 3) for key in ("interpreter_s", "import_s", "first_response_s")},
+        "requests": [{"path": request["path"], "status": request["status"],
+                      "seconds": round(median(run["requests"][i]["seconds"] for run in first), 3)}
+                     for i, request in enumerate(first[0]["requests"])],
+        "heavy_libraries_loaded": sorted({name for run in first for name in run["libraries"]}),
+    }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time and time to first request of the backend")
+    parser.add_argument("runs", nargs="?", type=int, default=3, help="fresh processes for the first request timing")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list per module")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds allowed until the first response")
+    args = parser.parse_args()
+
+    report = benchmark(args.runs, args.top)
+    print(json.dumps(report, indent=2))
+
+    first = report["first_request"]
+    failed = False
+    if first["first_response_s"] > args.budget:
+        print(f"[!] First response after {first['first_response_s']:.3f}s, budget is {args.budget:.3f}s")
+        failed = True
+    if first["heavy_libraries_loaded"]:
+        print(f"[!] Read-only requests imported: {', '.join(first['heavy_libraries_loaded'])}")
+        failed = True
+    if failed:
+        sys.exit(1)
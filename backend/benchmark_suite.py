@@ -0,0 +1,230 @@
+#benchmark suite for the backend paths that grow with the archive, run against synthetic archives
+#(synthetic_archive.py) of several sizes with stub models, so no network or model download is needed
+#   python benchmark_suite.py [--sizes 1000 10000 100000] [--output FILE] [--baseline FILE]
+#                             [--save-baseline] [--tolerance 0.25]
+#every size runs in a fresh process inside a temporary copy of the backend folder layout, results
+#(seconds per benchmark, plus how each one scales with the archive size) are written as json and
+#compared with the baseline, exits with status 1 when something got slower than the tolerance allows
+#per-text paths (clean, flag_keywords) time a fixed sample so they should not grow with the archive
+#timings depend on the machine, so the baseline is not committed (.gitignore), make one on the
+#machine that will run the comparison, from the code to compare against:
+#   git checkout main && python benchmark_suite.py --save-baseline
+#   git checkout my-branch && python benchmark_suite.py
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from statistics import median
+from time import perf_counter, sleep
+
+from keyword_matcher import MODERATION_LIST
+
+SIZES = (1000, 10000, 100000)
+RESULTS = "benchmark_results.json"
+BASELINE = "benchmark_baseline.json"
+TOLERANCE = 0.25
+#differences below this many seconds are noise, never a regression
+MIN_DELTA = 0.005
+#a scaling exponent this much above the baseline's means a path went from e.g. O(1) to O(history)
+SCALING_TOLERANCE = 0.3
+SAMPLE = 1000
+SUBMITS = 50
+DELETE_THREADS = 10
+DELETE_BEFORE_SHARE = 0.05
+
+#stands in for a transformers pipeline: same call signature and output shape (all labels per
+#text), labels derived from the text so results are stable, no tokenizer so texts are not windowed
+class StubClassifier:
+    LABELS = {"sentiment": ("LABEL_0", "LABEL_1", "LABEL_2"), "toxicity": ("toxic", "non_toxic")}
+
+    def __init__(self, name):
+        self.labels = self.LABELS[name]
+
+    def __call__(self, texts, **kwargs):
+        outputs = []
+        for text in texts:
+            best = sum(map(ord, text[:64])) % len(self.labels)
+            outputs.append([{"label": label, "score": 0.9 if i == best else 0.1 / len(self.labels)}
+                            for i, label in enumerate(self.labels)])
+        return outputs
+
+def install_stub_models():
+    from model_registry import registry
+    import sentimental_analysis #registers the real loaders first
+
+    for name in ("sentiment", "toxicity"):
+        registry.register(name, lambda name=name: StubClassifier(name), version=f"stub:{name}")
+
+def timed(results, name, fn, *args):
+    t0 = perf_counter()
+    value = fn(*args)
+    results[name] = perf_counter() - t0
+    return value
+
+def wait_for(pipeline, entry_id):
+    #the pipeline forgets an entry once it is logged
+    while (pipeline.status(entry_id) or {"state": "done"})["state"] not in ("done", "error"):
+        sleep(0.0005)
+
+#runs in a fresh process with the archive's folder as working directory
+def run_suite(directory):
+    os.chdir(directory)
+    os.environ["RENDER_ON_WRITE"] = "0" #charts are timed on their own below
+    os.environ["RENDER_WORKERS"] = "1"
+    seconds, counts = {}, {}
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        install_stub_models()
+        import app
+        import charts
+        import content_analysis
+        import delete_data
+        import sentimental_analysis
+        import text_normalizer
+        from entry_store import raw_store, log_store
+        from moderation_jobs import pipeline
+        from pagination import order_index
+        from reply_index import reply_index
+        from search_index import search_index
+        from tag_index import tag_index
+        from topic_engine import topic_engine
+
+        #first use migrates user-text.json/content_log_cleaned.json and builds every index
+        entries = timed(seconds, "load_raw_store", raw_store.entries)
+        timed(seconds, "load_log_store", log_store.entries)
+        counts["entries"] = len(entries)
+
+        #first use of the lazily imported libraries, kept out of the timings below
+        timed(seconds, "import_sklearn", text_normalizer.stop_words)
+        timed(seconds, "import_plotting", charts.figure)
+
+        texts = [entry["text"] for entry in entries[:SAMPLE]]
+        timed(seconds, "clean", lambda: [sentimental_analysis.clean(text) for text in texts])
+        timed(seconds, "clean_cached", lambda: [sentimental_analysis.clean(text) for text in texts])
+        timed(seconds, "flag_keywords", lambda: [sentimental_analysis.flag_keywords(text) for text in texts])
+        timed(seconds, "flag_keywords_cached", lambda: [sentimental_analysis.flag_keywords(text) for text in texts])
+
+        #the tag_dict used to be rebuilt from every entry, now it's the tag index
+        timed(seconds, "tag_index_as_dict", tag_index.as_dict)
+        timed(seconds, "tag_index_rebuild", raw_store._rebuild, tag_index)
+
+        timed(seconds, "search_index_build", search_index.search, "family")
+        timed(seconds, "search", search_index.search, "family culture")
+        timed(seconds, "search_prefix", search_index.search, "ka*")
+
+        timed(seconds, "topic_model_refit", topic_engine.update, True)
+        timed(seconds, "topic_model", content_analysis.topic_model)
+        timed(seconds, "load_data", content_analysis.load_data)
+        inputs = timed(seconds, "chart_inputs", content_analysis.chart_inputs)
+        for output_name, data in inputs.items():
+            seconds[f"chart:{output_name}"] = charts.timed_render(output_name, data)
+
+        #submit -> classify (stub models) -> content log, one entry at a time
+        client = app.app.test_client()
+        requests, end_to_end = [], []
+        for i, text in enumerate(texts[:SUBMITS]):
+            t0 = perf_counter()
+            response = client.post("/submit", json={"title": f"benchmark {i}", "text": text, "tags": "benchmark"})
+            requests.append(perf_counter() - t0)
+            wait_for(pipeline, response.get_json()["id"])
+            end_to_end.append(perf_counter() - t0)
+        seconds["submit_request"] = median(requests)
+        seconds["submit_entry"] = median(end_to_end)
+
+        #the threads with replies under them, deleted root first
+        roots = [entry["id"] for entry in raw_store.entries() if entry["parent_id"] is None]
+        threads = [root for root in roots if len(reply_index.subtree([root])) > 1][:DELETE_THREADS]
+        t0 = perf_counter()
+        counts["delete_entry_cascade"] = sum(len(delete_data.delete_entry(root)) for root in threads)
+        seconds["delete_entry_cascade"] = perf_counter() - t0
+
+        keys = order_index.keys
+        cutoff = keys[int(len(keys) * DELETE_BEFORE_SHARE)][0]
+        counts["delete_before"] = len(timed(seconds, "delete_before", delete_data.delete_before, cutoff) or [])
+    return {"seconds": seconds, "counts": counts}
+
+def scaling(sizes):
+    '''Per benchmark, the exponent k of time ~ entries^k between the smallest and largest archive'''
+    if len(sizes) < 2:
+        return {}
+    ordered = sorted(sizes, key=int)
+    small, large = sizes[ordered[0]]["seconds"], sizes[ordered[-1]]["seconds"]
+    ratio = math.log(int(ordered[-1]) / int(ordered[0]))
+    return {name: round(math.log(max(large[name], 1e-6) / max(small[name], 1e-6)) / ratio, 2)
+            for name in small if name in large and max(small[name], large[name]) > MIN_DELTA}
+
+def benchmark(sizes=SIZES, seed=0):
+    from synthetic_archive import write_archive
+
+    report = {"meta": {"date": datetime.now().isoformat(), "python": platform.python_version(),
+                       "platform": platform.platform(), "cpus": os.cpu_count(), "seed": seed},
+              "sizes": {}}
+    context = multiprocessing.get_context("spawn")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            #same layout as the repo, the backend writes charts to ../public/static
+            directory = os.path.join(tmp, "backend")
+            os.makedirs(os.path.join(tmp, "public", "static"))
+            t0 = perf_counter()
+            write_archive(directory, n, seed)
+            shutil.copy(MODERATION_LIST, directory)
+            print(f"Generated {n} entries in {perf_counter() - t0:.1f}s", file=sys.stderr)
+            with context.Pool(1) as pool:
+                report["sizes"][str(n)] = pool.apply(run_suite, (directory,))
+    report["scaling"] = scaling(report["sizes"])
+    return report
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    '''Benchmarks slower than the baseline by more than the tolerance, and paths that scale worse'''
+    regressions = []
+    for size, run in report["sizes"].items():
+        before = baseline.get("sizes", {}).get(size, {}).get("seconds", {})
+        for name, seconds in run["seconds"].items():
+            if name in before and seconds > before[name] * (1 + tolerance) and seconds - before[name] > MIN_DELTA:
+                regressions.append(f"{name} @ {size}: {before[name]:.4f}s -> {seconds:.4f}s")
+    for name, exponent in report.get("scaling", {}).items():
+        before = baseline.get("scaling", {}).get(name)
+        if before is not None and exponent > before + SCALING_TOLERANCE:
+            regressions.append(f"{name} scaling: entries^{before} -> entries^{exponent}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the backend against synthetic archives")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=RESULTS)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    report = benchmark(args.sizes, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for size, run in report["sizes"].items():
+        print(f"{size} entries")
+        for name, seconds in run["seconds"].items():
+            print(f"  {name:40s} {seconds * 1000:10.2f} ms")
+    if report["scaling"]:
+        print("scaling (time ~ entries^k)")
+        for name, exponent in report["scaling"].items():
+            print(f"  {name:40s} {exponent:10.2f}")
+
+    if args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("[!] Slower than the baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+    else:
+        print(f"[!] No baseline at {args.baseline}, run with --save-baseline on the code to compare against to create one")
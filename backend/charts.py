@@ -0,0 +1,176 @@
+import logging
+import os
+from collections import Counter
+from time import perf_counter
+
+from entry_store import temp_path
+
+#drawing code for the admin dashboard images, kept free of the data stores and models so render
+#worker processes (render_engine.py) only import matplotlib/pandas/wordcloud
+#every chart builds its own Figure instead of going through pyplot's global state, so charts can
+#be drawn side by side
+#the plotting libraries are imported by the first chart drawn, the server imports this module
+#for STATIC_PATH without paying for them
+
+log = logging.getLogger(__name__)
+
+#where the dashboard images go (served by the frontend as /static/...)
+STATIC_PATH = "../public/static"
+
+def figure(**kwargs):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    return Figure(**kwargs)
+
+def save_chart(fig, output_name):
+    #written next to the final file and renamed over it, so the dashboard never loads a half-written png
+    os.makedirs(STATIC_PATH, exist_ok=True)
+    output_path = os.path.join(STATIC_PATH, output_name)
+    tmp_path = temp_path(output_path)
+    fig.savefig(tmp_path, format="png")
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def create_wordcloud(frequencies, output_name = "wordcloud.png", title = "wordcloud"):
+    from wordcloud import WordCloud, STOPWORDS
+
+    stop_words = set(STOPWORDS)
+    frequencies = {word: count for word, count in frequencies.items() if word.lower() not in stop_words and count > 0}
+
+    #handling if there are no words
+    if not frequencies:
+        log.warning("No text found for: %s", title)
+        return
+
+    wordcloud = WordCloud(
+        width=800,
+        height=400,
+        background_color='white',
+        max_words=100,
+        max_font_size=60
+    ).generate_from_frequencies(frequencies)
+
+    fig = figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.set_title(title)
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis('off')
+
+    #save as image
+    output_path = save_chart(fig, output_name)
+    log.info("Saved: %s", output_path)
+
+def plot_topics(topics, output_name = "topic_model.png", title = "Top 10 Topics"):
+    n_topics = len(topics)
+    if not n_topics:
+        log.warning("No topic model yet")
+        return
+    cols = 2
+    rows = (n_topics + 1) // cols
+
+    fig = figure(figsize=(14, rows * 3))
+    axes = fig.subplots(rows, cols, squeeze=False).flatten()
+
+    for topic_idx, (top_features, weights) in enumerate(topics):
+        ax = axes[topic_idx]
+        ax.barh(top_features[::-1], weights[::-1], color='skyblue')
+        ax.set_title(f"Topic #{topic_idx}")
+        ax.set_xlabel("Weight")
+
+    # Hide any extra subplots
+    for i in range(n_topics, len(axes)):
+        fig.delaxes(axes[i])
+
+    fig.tight_layout()
+    save_chart(fig, output_name)
+
+def chart_distribution(counts, output_name = "sentiment_chart.png", title = "sentiment_chart"):
+    import pandas as pd
+
+    #counts per category, sorted like a groupby would
+    counts = pd.Series(dict(sorted(counts.items())), dtype=float)
+    if counts.sum() <= 0:
+        log.warning("Nothing to chart for: %s", title)
+        return
+    # Let's visualize the sentiments
+    fig = figure(figsize=(6,6), dpi=100)
+    ax = fig.add_subplot(111)
+    counts.plot.pie(
+        ax=ax,
+        autopct='%1.1f%%',
+        startangle=270,
+        fontsize=12, label=""
+        )
+
+    ax.set_title(title)
+    output_path = save_chart(fig, output_name)
+
+    log.info("Saved chart to: %s", output_path)
+
+def chart_flag_reasons(reason_counts, output_name='flag_reason_chart.png'):
+    if not reason_counts:
+        log.warning("No flag reasons to chart")
+        return
+
+    import pandas as pd
+
+    # Convert to DataFrame for plotting
+    reasons_df = pd.DataFrame.from_dict(dict(reason_counts), orient='index', columns=['count'])
+    reasons_df = reasons_df.sort_values('count', ascending=False)
+
+    # Plot as horizontal bar chart
+    fig = figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    reasons_df.plot(kind='barh', legend=False, color='salmon', ax=ax)
+    ax.set_title("Distribution of Flagging Reasons")
+    ax.set_xlabel("Number of Entries")
+    ax.set_ylabel("Reason")
+    ax.invert_yaxis()  # Most frequent at top
+    fig.tight_layout()
+
+    # Save the chart
+    output_path = save_chart(fig, output_name)
+
+    log.info("Saved flag reason chart to: %s", output_path)
+
+def chart_keywords(keyword_counts, output_name="top_flagged_keywords.png", title="Most Frequent Flagged Keywords"):
+    most_common = Counter(keyword_counts).most_common(10)   # Get most common keywords
+    keywords, counts = [], []
+
+    for i in most_common:
+        keywords.append(i[0])
+        counts.append(i[1])
+
+    # Plot
+    fig = figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    ax.barh(keywords[::-1], counts[::-1], color='salmon')
+    ax.set_title(title)
+    ax.set_xlabel("Frequency")
+    fig.tight_layout()
+
+    # Save
+    save_chart(fig, output_name)
+
+def render_chart(output_name, data):
+    if output_name == 'all_inclusive_cloud.png':
+        create_wordcloud(data, output_name = output_name, title = "all_inclusive_cloud")
+    elif output_name == 'sentiment_distribution.png':
+        chart_distribution(data, output_name = output_name, title = "Sentiment Distribution of All Entries")
+    elif output_name == 'flagging_distribution.png':
+        chart_distribution(data, output_name = output_name, title = "Flagged vs. Non-Flagged of All Entries")
+    elif output_name == 'flag_reason_chart.png':
+        chart_flag_reasons(data, output_name = output_name)
+    elif output_name == 'top_flagged_keywords.png':
+        chart_keywords(data, output_name = output_name, title = "Most Frequent Flagged Keywords")
+    elif output_name == 'topic_model.png':
+        plot_topics(data, output_name, "Top 10 Topics")
+    else:
+        raise ValueError(f"Unknown chart: {output_name}")
+
+def timed_render(output_name, data):
+    '''render_chart() that also returns how long the chart took, in seconds'''
+    t0 = perf_counter()
+    render_chart(output_name, data)
+    return perf_counter() - t0
@@ -0,0 +1,160 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from entry_store import atomic_write_json, file_lock
+
+log = logging.getLogger(__name__)
+
+#how many results to keep, least recently used ones are dropped first
+CACHE_SIZE = int(os.environ.get("CLASSIFICATION_CACHE_SIZE", "50000"))
+CACHE_PATH = os.environ.get("CLASSIFICATION_CACHE_PATH", "classification_cache.json")
+#new results between two saves of the cache file (it is also saved at exit)
+SAVE_EVERY = 500
+
+def normalize_text(text, lowercase=False):
+    #only differences no model can see are folded together (unicode form, runs of whitespace),
+    #stop words and punctuation are kept since they change what a post means ("not good")
+    text = " ".join(unicodedata.normalize("NFC", text).split())
+    return text.lower() if lowercase else text
+
+def cache_key(namespace, version, text, lowercase=False):
+    digest = hashlib.blake2b(normalize_text(text, lowercase).encode("utf-8"), digest_size=16).hexdigest()
+    return f"{namespace}|{version}|{digest}"
+
+
+#persistent lru cache of per-text results (model labels, flagged keywords), keyed by
+#namespace + model/list version + hash of the normalized text, so a repeated post never
+#goes through the models again and a new model version never sees old results
+#several server processes share the file: a save merges in what the others saved meanwhile
+class ClassificationCache:
+    def __init__(self, path=CACHE_PATH, size=CACHE_SIZE):
+        self.path = path
+        self.size = size
+        self._results = OrderedDict() #key -> result, least recently used first
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock() #one writer of the cache file at a time
+        self._loaded = False
+        self._unsaved = 0
+        self.bypass = False #every lookup misses, the fresh results replace the cached ones (backfill.py --no-cache)
+
+        #metrics per namespace: hits, misses and the time spent computing misses
+        self._stats = {}
+
+        atexit.register(self.save)
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f).get("entries", [])[-self.size:]
+        except Exception as e:
+            log.warning("Ignoring unreadable classification cache %s: %s", self.path, e)
+            return []
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        for key, result in self._read():
+            self._results[key] = result
+
+    def load(self):
+        '''Read the cache file now instead of on first use (serve.py, before forking workers)'''
+        with self._lock:
+            self._load()
+
+    def _namespace_stats(self, namespace):
+        return self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "compute_s": 0.0})
+
+    def peek_many(self, keys):
+        '''Like get_many but without counting towards the metrics or the lru order'''
+        with self._lock:
+            self._load()
+            return [None if self.bypass else self._results.get(key) for key in keys]
+
+    def get_many(self, namespace, keys):
+        '''Cached results for `keys`, None where there is none'''
+        results = []
+        with self._lock:
+            self._load()
+            stats = self._namespace_stats(namespace)
+            for key in keys:
+                result = None if self.bypass else self._results.get(key)
+                if result is None:
+                    stats["misses"] += 1
+                else:
+                    self._results.move_to_end(key)
+                    stats["hits"] += 1
+                results.append(result)
+        return results
+
+    def put_many(self, namespace, items, seconds=0.0):
+        '''Store (key, result) pairs that took `seconds` to compute together'''
+        save = False
+        with self._lock:
+            self._load()
+            self._namespace_stats(namespace)["compute_s"] += seconds
+            for key, result in items:
+                self._results[key] = result
+                self._results.move_to_end(key)
+                self._unsaved += 1
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+            save = self._unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def save(self, merge=True):
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved or not self.path:
+                    return
+                entries = list(self._results.items())
+                self._unsaved = 0
+            try:
+                with file_lock(self.path + ".lock"):
+                    if merge:
+                        #results other processes saved, ours count as the most recently used
+                        merged = OrderedDict(self._read())
+                        for key, result in entries:
+                            merged[key] = result
+                            merged.move_to_end(key)
+                        entries = list(merged.items())[-self.size:]
+                    atomic_write_json(self.path, {"entries": entries})
+            except Exception as e:
+                log.warning("Could not save classification cache %s: %s", self.path, e)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._stats.clear()
+            self._unsaved = 1 #so the emptied cache gets written
+        self.save(merge=False)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def metrics(self):
+        with self._lock:
+            metrics = {"size": len(self._results), "max_size": self.size, "namespaces": {}}
+            for namespace, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                #latency saved: every hit avoided the average time of a miss
+                per_miss = stats["compute_s"] / stats["misses"] if stats["misses"] else 0.0
+                metrics["namespaces"][namespace] = {
+                    **stats,
+                    "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+                    "saved_s": stats["hits"] * per_miss
+                }
+            return metrics
+
+
+classification_cache = ClassificationCache()
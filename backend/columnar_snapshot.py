@@ -0,0 +1,269 @@
+import json
+import os
+import time
+import uuid
+
+from entry_store import StoreIndex, log_store, atomic_write_json, temp_path, SNAPSHOT_EVERY
+
+#typed analytics columns of the content log, kept as parquet next to the log
+#pyarrow is imported the first time parquet is written or read, keeping it out of startup
+COLUMNS = ["id", "timestamp", "sentiment", "toxicity", "flagged", "keywords", "reason", "cleaned_text"]
+_schema = None
+
+def schema():
+    global _schema
+    if _schema is None:
+        import pyarrow as pa
+        _schema = pa.schema([
+            ("id", pa.string()),
+            ("timestamp", pa.string()),
+            ("sentiment", pa.dictionary(pa.int8(), pa.string())),
+            ("toxicity", pa.dictionary(pa.int8(), pa.string())),
+            ("flagged", pa.bool_()),
+            ("keywords", pa.list_(pa.string())),
+            ("reason", pa.string()),
+            ("cleaned_text", pa.string()),
+            ("row", pa.int64()), #write order, a delete/overwrite hides every older row of its id
+        ])
+    return _schema
+
+#merge everything into one file once there are this many small files
+MAX_PARTS = 32
+ROW_GROUP_SIZE = 64 * 1024
+#files nobody references any more (left by a crashed process) are removed after this many seconds
+ORPHAN_AGE = 60 * 60
+#a part merged away may still be open in a reader, it is looked for again this many times
+READ_ATTEMPTS = 3
+
+def entry_row(entry, row):
+    keywords = entry.get("keywords")
+    return {
+        "id": entry.get("id"),
+        "timestamp": entry.get("timestamp"),
+        "sentiment": entry.get("sentiment"),
+        "toxicity": entry.get("toxicity"),
+        "flagged": entry.get("flagged") if isinstance(entry.get("flagged"), bool) else None,
+        "keywords": [str(k) for k in keywords if k is not None] if isinstance(keywords, list) else [],
+        "reason": entry.get("reason") if isinstance(entry.get("reason"), str) else None,
+        "cleaned_text": entry.get("cleaned_text"),
+        "row": row,
+    }
+
+
+#columnar copy of the content log for analytics (content_analysis.load_frames): sentiment/toxicity
+#as categoricals, flagged as bool, keywords as a list column, maintained by the log store like any
+#other index
+#the writer (the only server process, or serve.py's refresher) turns the rows logged since its last
+#snapshot into one more small parquet file (one row group) on every snapshot, deletes are
+#tombstones, and the small files are merged into one every MAX_PARTS snapshots
+#readers (writer = False, serve.py's web workers) never write or remove a file: they read the
+#files the writer's last snapshot lists and keep in memory only what was logged after it
+class ColumnarSnapshot(StoreIndex):
+    def __init__(self, snapshot_path, directory):
+        super().__init__(snapshot_path)
+        self.directory = directory
+        self.writer = True
+        self.parts = []
+        self._writing = {}
+        self._retired = []
+        self._saved = None #readers: (stamp, seq, parts, tombstones) of the writer's snapshot file
+
+    def reset(self):
+        #files of the previous state are removed once the new state is saved
+        if self.writer:
+            self._retired.extend(self.parts)
+        self.parts = []
+        self._writing = {} #part name -> rows, taken by a snapshot and not on disk yet
+        self.pending = []
+        self.tombstones = {} #id -> row count at delete time, rows of the id below that are dead
+        self.rows = 0
+        self.recent = {} #readers: id -> (seq, row or None once deleted), changes the writer's snapshot lacks
+
+    def on_put(self, entry):
+        if not self.writer:
+            self.recent[entry["id"]] = (self.store.seq, entry_row(entry, None))
+            if len(self.recent) % SNAPSHOT_EVERY == 0:
+                self._forget_saved()
+            return
+        self.pending.append(entry_row(entry, self.rows))
+        self.rows += 1
+
+    def on_delete(self, entry):
+        if not self.writer:
+            self.recent[entry["id"]] = (self.store.seq, None)
+            return
+        self.tombstones[entry["id"]] = self.rows
+
+    def from_snapshot(self, state):
+        self.parts = state.get("parts", [])
+        self.tombstones = state.get("tombstones", {})
+        self.rows = state.get("rows", 0)
+        missing = [part for part in self.parts if not os.path.exists(os.path.join(self.directory, part))]
+        if missing:
+            raise FileNotFoundError(f"missing snapshot parts: {', '.join(missing)}")
+
+    #writer
+    def checkpoint(self):
+        #pending rows become one more file, written (with the state that lists it) after the lock
+        self._unsaved = 0
+        if not self.writer:
+            return lambda: None
+        part = None
+        if self.pending:
+            part = (f"part-{uuid.uuid4().hex}.parquet", self.pending)
+            self._writing[part[0]] = self.pending
+            self.pending = []
+        state = {"parts": self.parts + list(self._writing), "tombstones": dict(self.tombstones), "rows": self.rows}
+        seq, retired, self._retired = self.seq, self._retired, []
+        return lambda: self._write(seq, state, part, retired)
+
+    def _write(self, seq, state, part, retired):
+        if part is not None:
+            import pyarrow as pa
+            name, rows = part
+            self._write_part(name, pa.Table.from_pylist(rows, schema=schema()))
+            with self.store.reading():
+                if self._writing.pop(name, None) is not None:
+                    self.parts.append(name)
+                else:
+                    self._retired.append(name) #rebuilt meanwhile
+        if len(state["parts"]) > MAX_PARTS:
+            merged = self._merge(state)
+            retired = retired + state["parts"]
+            state = {"parts": [merged], "tombstones": {}, "rows": state["rows"]}
+        atomic_write_json(self.snapshot_path, {"seq": seq, "state": state})
+        #readers that opened the list before this write look for it again (table())
+        self._remove(retired)
+
+    def _write_part(self, name, table):
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp = temp_path(path)
+        pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp, path)
+
+    def _merge(self, state):
+        #read and written without the store's lock, then swapped in for the parts it replaces
+        live = self._read(state["parts"], state["tombstones"], [], set(), None)
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        self._write_part(name, live)
+        with self.store.reading():
+            if self.parts[:len(state["parts"])] == state["parts"]:
+                self.parts = [name] + self.parts[len(state["parts"]):]
+                for entry_id, limit in state["tombstones"].items():
+                    if self.tombstones.get(entry_id) == limit:
+                        del self.tombstones[entry_id]
+            else:
+                #rebuilt meanwhile, the merged file belongs to a state that is already gone
+                self._retired.append(name)
+        #leftovers of processes that died before saving
+        for orphan in os.listdir(self.directory):
+            path = os.path.join(self.directory, orphan)
+            if orphan not in self.parts and orphan not in state["parts"] and orphan != name \
+                    and time.time() - os.path.getmtime(path) > ORPHAN_AGE:
+                self._remove([orphan])
+        return name
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    #readers
+    def _saved_state(self):
+        '''(seq, parts, tombstones) of the writer's last snapshot, read again when the file changed'''
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return 0, [], {}
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if self._saved is None or self._saved[0] != stamp:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            self._saved = (stamp, snapshot["seq"], snapshot["state"]["parts"], snapshot["state"]["tombstones"])
+        return self._saved[1:]
+
+    def _forget_saved(self):
+        #what the writer's files hold is read from them, only newer changes stay in memory
+        seq = self._saved_state()[0]
+        if seq <= self.store.seq:
+            self.recent = {entry_id: change for entry_id, change in self.recent.items() if change[0] > seq}
+
+    #reads
+    def _view(self):
+        '''With the store locked: (parts, tombstones, rows not in the parts, ids those rows replace)'''
+        if self.writer:
+            writing = [row for rows in self._writing.values() for row in rows]
+            return list(self.parts), dict(self.tombstones), writing + self.pending, set()
+        seq, parts, tombstones = self._saved_state()
+        if seq > self.store.seq:
+            #saved from a log that was since replaced (backfill.py), only what this process applied counts
+            parts, tombstones = [], {}
+        else:
+            self._forget_saved()
+        rows = [row for _, row in self.recent.values() if row is not None]
+        return parts, tombstones, rows, set(self.recent)
+
+    def _read(self, parts, tombstones, rows, replaced, columns):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        wanted = list(schema().names) if columns is None else list(dict.fromkeys(["id", "row"] + columns))
+        tables = [pq.read_table(os.path.join(self.directory, part), columns=wanted) for part in parts]
+        if replaced and tables:
+            table = pa.concat_tables(tables, promote_options="permissive")
+            tables = [table.filter(pc.invert(pc.is_in(table["id"], value_set=pa.array(list(replaced), pa.string()))))]
+        if rows:
+            tables.append(pa.Table.from_pylist(rows, schema=schema()).select(wanted))
+        if not tables:
+            return pa.schema([schema().field(name) for name in wanted]).empty_table()
+        return self._live(pa.concat_tables(tables, promote_options="permissive"), tombstones)
+
+    def _live(self, table, tombstones):
+        #drop rows hidden by a later delete or overwrite
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if not tombstones or not table.num_rows:
+            return table
+        ids = list(tombstones)
+        limits = pa.array([tombstones[i] for i in ids], pa.int64())
+        index = pc.index_in(table["id"], value_set=pa.array(ids, pa.string()))
+        limit = pc.take(limits, index)
+        dead = pc.fill_null(pc.less(table["row"], limit), False)
+        return table.filter(pc.invert(dead))
+
+    def table(self, columns=None):
+        '''The live rows as an arrow table, only `columns` (plus id) are read from disk'''
+        for attempt in range(READ_ATTEMPTS):
+            with self.store.reading():
+                view = self._view()
+            try:
+                table = self._read(*view, columns)
+                break
+            except FileNotFoundError:
+                #a part was merged away after the view was taken
+                if attempt < READ_ATTEMPTS - 1:
+                    continue
+                if not self.writer:
+                    raise
+                #the writer's own files are gone, start over from the log
+                with self.store.reading():
+                    self.store._rebuild(self)
+                    view = self._view()
+                table = self._read(*view, columns)
+        keep = COLUMNS if columns is None else list(dict.fromkeys(["id"] + columns))
+        return table.select(keep)
+
+    def to_pandas(self, columns=None):
+        '''The live rows as a dataframe, sentiment/toxicity come out as pandas categoricals'''
+        return self.table(columns).to_pandas()
+
+
+analytics_snapshot = ColumnarSnapshot("analytics_snapshot.json", "analytics_snapshot")
+log_store.add_index(analytics_snapshot)
@@ -1,234 +1,90 @@
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-
 import pandas as pd
-import os
-import json 
-import numpy as np
-import string
-import re  
+import logging
 
 from collections import Counter
-from wordcloud import WordCloud, STOPWORDS
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-from sklearn.decomposition import NMF
-from time import time
-from sentimental_analysis import clean 
+from entry_store import log_store
+from entry_reader import iter_chunks, CHUNK_SIZE
+from columnar_snapshot import analytics_snapshot, COLUMNS
+from analytics_store import aggregates, entry_terms
+from topic_engine import topic_engine
+#the charts themselves are drawn with matplotlib's Figure API in charts.py
+from charts import plot_topics
+
+log = logging.getLogger(__name__)
+
+#terms handed to the wordcloud (it draws at most 100 after dropping stop words)
+WORDCLOUD_TERMS = 500
+
+#the fields a one-off wordcloud is counted from, only these are read instead of whole entries
+WORDCLOUD_COLUMNS = ['reason', 'cleaned_text']
+
+#source: a store (default the content log) or the path of any stored/legacy file (entry_reader.py)
+#analytics columns of the content log are read from its typed columnar snapshot (columnar_snapshot.py)
+def in_snapshot(source, columns):
+    return source is log_store and columns is not None and set(columns) <= set(COLUMNS)
+
+def load_frames(source=log_store, columns=None, chunk_size=CHUNK_SIZE):
+    '''The entries as a series of small dataframes, memory stays flat however large the log is'''
+    if in_snapshot(source, columns):
+        for batch in analytics_snapshot.table(columns).select(columns).to_batches(max_chunksize=chunk_size):
+            yield batch.to_pandas()
+        return
+    for chunk in iter_chunks(source, columns, chunk_size):
+        yield pd.DataFrame(chunk, columns=columns)
 
-def load_data(filepath): 
+def load_data(source=log_store, columns=None): 
     try:
-        df = pd.read_json(filepath)
-        return df
+        if in_snapshot(source, columns):
+            return analytics_snapshot.to_pandas(columns)[columns]
+        frames = list(load_frames(source, columns))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
     except Exception as e:
-        print(f"Error loading file: {e}")
+        log.error("Error loading file: %s", e)
         return pd.DataFrame()
 
-def create_wordcloud(df, reason_filter=None, output_name = "wordcloud.png", title = "wordcloud"):
-    if reason_filter:
-        df = df[df['reason'].str.contains(reason_filter, case=False, na=False)]
-    
-    #combining all data into a string for word clouding 
-    text = ''. join(df['cleaned_text'].dropna().tolist())
-    stop_words = set(STOPWORDS)
-
-    #handling if string is empty 
-    if not text.strip(): 
-        print(f"[!] No text found for reason: {reason_filter}")
-        return
-    
-    wordcloud = WordCloud(
-        width=800,
-        height=400,
-        background_color='white',
-        stopwords=stop_words,
-        max_words=100,
-        max_font_size=60
-    ).generate(text)
-
-    plt.figure(figsize=(10, 5))
-    plt.title(title)
-    plt.imshow(wordcloud, interpolation='bilinear')
-    plt.axis('off')
-
-    #save as image
-    path = "../public/static"
-    os.makedirs(path, exist_ok = True)
-    output_path = os.path.join(path, output_name)
-    plt.savefig(output_path)
-    plt.close()
-    print(f"Saved: {output_path}")
-
-def topic_model(df, output_name = "topic_model.png", title = "Top 10 Topics"):
-    df['content'] = df['title'].fillna('') + ' ' + df['text'].fillna('')
-    df['cleaned_content'] = df['content'].apply(clean)
-
-    n_samples = 2000
-    n_features = 1000
-    n_topics = 8
+#word frequencies for a wordcloud, for one-off clouds (e.g. /analytics/wordcloud?reason=), a chunk at a time
+#the dashboard cloud uses the running counts in analytics_store instead
+def term_frequencies(source=log_store, reason_filter=None):
+    counts = Counter()
+    frames = [source] if isinstance(source, pd.DataFrame) else load_frames(source, WORDCLOUD_COLUMNS)
+    for df in frames:
+        if reason_filter:
+            df = df[df['reason'].str.contains(reason_filter, case=False, na=False, regex=False)]
+        for text in df['cleaned_text'].dropna():
+            counts.update(entry_terms(text))
+    return counts
+
+def topic_model(output_name = "topic_model.png", title = "Top 10 Topics"):
     n_top_words = 5
 
-    #creating vectors 
-    t0 = time()
-    tokens = df['cleaned_content'] #corpus ? 
-    vectorizer = TfidfVectorizer()
-    vectorizer = TfidfVectorizer(max_features = n_features, ngram_range=(1,2))
-
-    X = vectorizer.fit_transform(tokens)
-
-    #create TFIDF matrix 
-    features = vectorizer.get_feature_names_out()
-    tfidf_df = pd.DataFrame(X.toarray(), columns = features)
-
-    print("Showing TFIDF matrix... ")
-    tfidf_df.head()
-    print("Fitting the NMF model with n_samples=%d and n_features=%d..."
-        % (n_samples, n_features))
-    
-
-    #perform modeling
-    nmf = NMF(n_components = n_topics, random_state = 1).fit(tfidf_df)
-    print("done in %0.3fs." % (time() - t0))
+    #the topic engine keeps a sparse tf-idf/nmf model between runs and only folds in new posts,
+    #with a full refit now and then (topic_engine.py)
+    topic_engine.update()
+    topics = topic_engine.topics(n_top_words)
+    if not topics:
+        log.warning("No topic model yet")
+        return
 
     #list out topics 
-    for topic_idx, topic in enumerate(nmf.components_):
-        print("Topic #%d:" % topic_idx)
-        print(" ".join([features[i]
-                        for i in topic.argsort()[:-n_top_words - 1:-1]]))
-        print()
+    for topic_idx, (terms, _) in enumerate(topics):
+        log.debug("Topic #%d: %s", topic_idx, " ".join(terms))
     
     #Create a bar chart of top 10 topics 
-    plot_topics(nmf, features, n_top_words, output_name, title)
-
-def plot_topics(nmf_model, features, n_top_words, output_name, title):
-    n_topics = nmf_model.components_.shape[0]
-    cols = 2
-    rows = (n_topics + 1) // cols
-
-    fig, axes = plt.subplots(rows, cols, figsize=(14, rows * 3))
-    axes = axes.flatten()
-
-    for topic_idx, topic in enumerate(nmf_model.components_):
-        top_indices = topic.argsort()[:-n_top_words - 1:-1]
-        top_features = [features[i] for i in top_indices]
-        weights = topic[top_indices]
-
-        ax = axes[topic_idx]
-        ax.barh(top_features[::-1], weights[::-1], color='skyblue')
-        ax.set_title(f"Topic #{topic_idx}")
-        ax.set_xlabel("Weight")
-
-    # Hide any extra subplots
-    for i in range(n_topics, len(axes)):
-        fig.delaxes(axes[i])
-
-    plt.tight_layout()
-    path = "../public/static"
-    os.makedirs(path, exist_ok=True)
-    output_path = os.path.join(path, output_name)
-    plt.savefig(output_path)
-    plt.close()
-
-def chart_distribution(df, filter = None, output_name = "sentiment_chart.png", title = "sentiment_chart"): 
-    counts = df.groupby([filter]).size()
-    # Let's visualize the sentiments
-    fig = plt.figure(figsize=(6,6), dpi=100)
-    ax = plt.subplot(111)
-    counts.plot.pie(
-        ax=ax, 
-        autopct='%1.1f%%', 
-        startangle=270, 
-        fontsize=12, label=""
-        )
-    
-    plt.title(title)
-    path = "../public/static"
-    output_path = os.path.join(path, output_name)
-    plt.savefig(output_path)
-    plt.close()
-
-    print(f"[✔] Saved chart to: {output_path}")
-
-def chart_flag_reasons(df, output_name='flag_reason_chart.png'):
-    # select reason column and remove null values 
-    reasons_series = df['reason'].dropna()
-    reasons_series = reasons_series[reasons_series != "NOT FLAGGED"]
-
-    all_reasons = []
-    for reason in reasons_series:
-        if isinstance(reason, list):
-            # Shouldn't happen if reason was stored correctly, but just in case
-            flag_labels = reason
-        else:
-            flag_labels = [r.strip() for r in str(reason).split(';')]
-
-        for i in flag_labels:
-            if i.startswith("KEYWORD"):
-                all_reasons.append("KEYWORD")
-            elif i:  # skip empty strings
-                all_reasons.append(i)
-
-    #count occurences 
-    reason_counts = Counter(all_reasons)
-
-    # Convert to DataFrame for plotting
-    reasons_df = pd.DataFrame.from_dict(reason_counts, orient='index', columns=['count'])
-    reasons_df = reasons_df.sort_values('count', ascending=False)
-
-    # Plot as horizontal bar chart
-    plt.figure(figsize=(10, 6))
-    reasons_df.plot(kind='barh', legend=False, color='salmon')
-    plt.title("Distribution of Flagging Reasons")
-    plt.xlabel("Number of Entries")
-    plt.ylabel("Reason")
-    plt.gca().invert_yaxis()  # Most frequent at top
-    plt.tight_layout()
-
-    # Save the chart
-    path = "../public/static"
-    os.makedirs(path, exist_ok=True)
-    output_path = os.path.join(path, output_name)
-    plt.savefig(output_path)
-    plt.close()
-
-    print(f"[✔] Saved flag reason chart to: {output_path}")
-
-def chart_keywords(df, output_name="top_flagged_keywords.png", title="Most Frequent Flagged Keywords"):
-    flagged_df = df[df['flagged'] == True] #get only flagged items and put them into a dataframe
-
-    # flatten and convert to a list 
-    keyword_list = flagged_df['keywords'].explode().dropna().tolist()
-    keyword_counts = Counter(keyword_list) #count occurences
-    most_common = keyword_counts.most_common(10)   # Get most common keywords
-    keywords, counts = [], []
-
-    for i in most_common: 
-        keywords.append(i[0])
-        counts.append(i[1])
-
-    # Plot
-    plt.figure(figsize=(10, 6))
-    plt.barh(keywords[::-1], counts[::-1], color='salmon')
-    plt.title(title)
-    plt.xlabel("Frequency")
-    plt.tight_layout()
-
-    # Save
-    output_path = os.path.join("../public/static", output_name)
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    plt.savefig(output_path)
-    plt.close() 
-
-def run_analysis(): 
-    df = load_data("content_log_cleaned.json")
-    print(df) 
-    create_wordcloud(df, reason_filter = None, output_name = 'all_inclusive_cloud.png', title = "all_inclusive_cloud")
-    chart_distribution(df, filter = "sentiment", output_name = "sentiment_distribution.png", title = "Sentiment Distribution of All Entries")
-    chart_distribution(df, filter = "flagged", output_name = "flagging_distribution.png", title = "Flagged vs. Non-Flagged of All Entries")
-    chart_flag_reasons(df, output_name = 'flag_reason_chart.png')
-    chart_keywords(df, output_name="top_flagged_keywords.png", title="Most Frequent Flagged Keywords")
-    topic_model(df)
-
-# if __name__ == "__main__":
-#    run_analysis() 
\ No newline at end of file
+    plot_topics(topics, output_name, title)
+
+#the data each dashboard image is drawn from, keyed by its file name
+#the running counters are kept up to date on every logged/deleted entry (analytics_store.py)
+#and the topic engine only folds in new posts, so nothing here reloads the whole content log
+def chart_inputs(): 
+    counts = aggregates.snapshot()
+    topic_engine.update()
+    return {
+        'all_inclusive_cloud.png': dict(counts["terms"].most_common(WORDCLOUD_TERMS)),
+        'sentiment_distribution.png': dict(counts["sentiment"]),
+        'flagging_distribution.png': dict(counts["flagged"]),
+        'flag_reason_chart.png': dict(counts["reasons"]),
+        'top_flagged_keywords.png': dict(counts["keywords"].most_common(10)),
+        'topic_model.png': topic_engine.topics(5),
+    }
@@ -1,94 +1,51 @@
-import json 
+import logging
 from datetime import datetime 
+from entry_store import raw_store, log_store
+from reply_index import reply_index
+from pagination import order_index
 
-def read_json(filepath): 
-    try:
-        with open(filepath, 'r') as f:  #this line is from StackOverflow
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading file: {e}")
-        return 
+log = logging.getLogger(__name__)
 
-def write_json(filepath, data): 
-    try: 
-        with open(filepath, 'w') as f: 
-            json.dump(data, f, indent=2)
-    except Exception as e: 
-        print(f"Error writing json: {e}")
-
-def delete_entry(entry_id, cascade = True): 
-    print(f"Deleting entry with the ID: {entry_id}")
-
-    #first delete from raw user-text.json
-    raw_path = "user-text.json"
-    raw_data = read_json(raw_path)  #entire user-text file 
-
-    if not raw_data or 'entries' not in raw_data:
-        print("[!] Invalid or missing data in user-text.json")
-        return
-    
-    original_len = len(raw_data['entries'])
-
-    raw_data['entries'] = [entry for entry in raw_data['entries'] if entry.get('id') != entry_id]
-    print(f"Deleted from user-text.json: {original_len - len(raw_data['entries'])} entries")
+def delete_entries(entry_ids, cascade = True): 
+    '''Delete several entries (and, with cascade, all replies below them) with one write per store'''
+    #collect the whole reply tree first from the reply index, no file is touched until we know everything to delete
+    ids = reply_index.subtree(entry_ids) if cascade else list(entry_ids)
 
-    #update tag_dict
-    for tag in list(raw_data['tag_dict'].keys()):
-        if entry_id in raw_data['tag_dict'][tag]: #access each tag
-            raw_data['tag_dict'][tag].remove(entry_id)
-            if not raw_data['tag_dict'][tag]: #if the list is now empty delete the key 
-                del raw_data['tag_dict'][tag]
-
-    #save updates in user-text 
-    write_json(raw_path, raw_data) 
+    #first delete from the raw user-text store, the tag and reply indexes follow the store
+    removed = raw_store.delete_many(ids)
+    log.info("Deleted from user-text.jsonl: %d entries", len(removed))
 
     #then delete from content_log_cleaned 
-    log_path = 'content_log_cleaned.json'
-    log_data = read_json(log_path)
-
     try: 
-        new_log_data = []
-        for entry in log_data: 
-            if entry.get('id') != entry_id: 
-                new_log_data.append(entry) 
-        log_data = new_log_data 
-        write_json(log_path, log_data)
-        print("Deleted from content_log_cleaned.json")
+        removed_logs = log_store.delete_many(ids)
+        log.info("Deleted from content_log_cleaned.jsonl: %d entries", len(removed_logs))
 
     except Exception as e: 
-        print(f"Error, content_logged_cleaned.json may be malformed: {e}")
-    
-    # Cascade delete for handling replies of a deleted entry 
-    if cascade: 
-        child_ids = [entry['id'] for entry in raw_data['entries'] if entry.get('parent_id') ==entry_id]
-        for child in child_ids: 
-            delete_entry(child, cascade = True) #recursively delete children 
+        log.error("Error, content_log_cleaned.jsonl may be malformed: %s", e)
 
-def delete_before(timestamp, cascade = True):
-    ''''Delete all entries before x timestamp, takes timestamp string as input'''
-    raw_path = 'user-text.json'
-    raw_data = read_json(raw_path)
+    return [entry['id'] for entry in removed]
 
-    if not raw_data or 'entries' not in raw_data:
-        print("[!] Invalid or missing data in user-text.json")
-        return
+def delete_entry(entry_id, cascade = True): 
+    log.info("Deleting entry with the ID: %s", entry_id)
+    return delete_entries([entry_id], cascade = cascade)
 
+def delete_before(timestamp, cascade = True):
+    ''''Delete all entries before x timestamp, takes timestamp string as input'''
     try: 
         cutoff = datetime.fromisoformat(timestamp)
     except ValueError: 
-        print("[!] Invalid timestamp format. Accepts ISO format only") 
+        log.error("Invalid timestamp format. Accepts ISO format only")
         return
     
-    ids_to_delete = []
-    for entry in raw_data['entries']: 
-        if datetime.fromisoformat(entry['timestamp']) < cutoff:
-            ids_to_delete.append(entry)
+    #entries are ordered by timestamp in the order index, so everything before the cutoff is one slice
+    #(stored timestamps are datetime.isoformat() strings, which sort the same way as the datetimes)
+    ids_to_delete = order_index.ids_before(cutoff.isoformat())
     
-    print(f"Found {len(ids_to_delete)} entries before {timestamp}. Deleting...")
-    print(ids_to_delete)
-    for e in ids_to_delete: 
-        delete_entry(e["id"], cascade = cascade)
+    log.info("Found %d entries before %s. Deleting...", len(ids_to_delete), timestamp)
+    log.debug("Deleting: %s", ids_to_delete)
+    return delete_entries(ids_to_delete, cascade = cascade)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     delete_entry("d19bbd51-0ee0-46df-befa-a775505ade4e")
     # delete_before("2025-06-08T13:08:00.093837")
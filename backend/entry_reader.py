@@ -0,0 +1,171 @@
+import json
+import logging
+import re
+from itertools import islice
+
+#streaming readers for every format entries have been stored in, so nothing has to parse a
+#whole file (or hold all of it) before the first entry can be used:
+#   array   a json array of entries, pretty-printed or not (content_log_cleaned.json)
+#   object  {"entries": [...], "tag_dict": {...}} (user-text.json)
+#   log     the append-only store logs ({"seq", "op", ...} per line, entry_store.py)
+#   jsonl   one entry per line, including the legacy per-flag lines of content_log.json
+#entries come out one at a time or in chunks, optionally reduced to the columns asked for
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+READ_BLOCK = 1 << 16
+
+WHITESPACE = re.compile(r"[\s,]*")
+ARRAY_START = re.compile(r"\[")
+ENTRIES_KEY = re.compile(r'"entries"\s*:\s*\[')
+
+def detect_format(path):
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(READ_BLOCK)
+        first_line = head.split("\n", 1)[0] if "\n" in head else head + f.readline()
+    stripped = head.lstrip()
+    if not stripped:
+        return "jsonl"
+    if stripped[0] == "[":
+        return "array"
+    try:
+        record = json.loads(first_line)
+    except json.JSONDecodeError:
+        #a '{' that doesn't close on its line is a pretty-printed object
+        return "object"
+    if isinstance(record, dict) and "op" in record and "seq" in record:
+        return "log"
+    if isinstance(record, dict) and "entries" in record and "id" not in record:
+        return "object"
+    return "jsonl"
+
+def iter_json_array(f, opening=None):
+    '''Objects of a json array one at a time, reading the file in blocks.
+    `opening` finds where the array starts (default: the first "[")'''
+    decoder = json.JSONDecoder()
+    opening = opening or ARRAY_START
+    buffer = f.read(READ_BLOCK)
+    while True:
+        match = opening.search(buffer)
+        if match:
+            pos = match.end()
+            break
+        more = f.read(READ_BLOCK)
+        if not more:
+            return
+        buffer += more
+
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        if pos >= len(buffer):
+            more = f.read(READ_BLOCK)
+            if not more:
+                return
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            #the object continues past what we have read so far
+            more = f.read(READ_BLOCK)
+            if not more:
+                raise
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield obj
+        pos = end
+        if pos > READ_BLOCK:
+            buffer, pos = buffer[pos:], 0
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                log.warning("Skipping malformed line in %s: %s", path, e)
+
+def iter_log(path):
+    #two passes: the first only remembers which record holds the final version of each id
+    #(later puts replace, dels remove), the second yields exactly those versions
+    final = {}
+    for position, record in enumerate(iter_jsonl(path)):
+        if record.get("op") == "put":
+            for entry in record.get("entries", []):
+                final[entry.get("id")] = position
+        elif record.get("op") == "del":
+            for entry_id in record.get("ids", []):
+                final.pop(entry_id, None)
+    for position, record in enumerate(iter_jsonl(path)):
+        if record.get("op") != "put":
+            continue
+        for entry in record.get("entries", []):
+            if final.get(entry.get("id")) == position:
+                yield entry
+
+def merge_flag_records(records):
+    #legacy content_log.json: one line per flag ({timestamp, entry_id, text, reason[, details]}),
+    #consecutive lines of one entry become one entry with all of its reasons
+    current = None
+    for record in records:
+        if "entry_id" not in record:
+            if current is not None:
+                yield flag_entry(current)
+                current = None
+            yield record
+            continue
+        if current is None or current["id"] != record["entry_id"]:
+            if current is not None:
+                yield flag_entry(current)
+            current = {"timestamp": record.get("timestamp"), "id": record["entry_id"], "title": "",
+                       "text": record.get("text") or "", "tags": [], "parent_id": None, "reasons": []}
+        #older lines hold a single reason, newer ones a list of them
+        reason = record.get("reason")
+        current["reasons"].extend(str(r) for r in (reason if isinstance(reason, list) else [reason]) if r)
+    if current is not None:
+        yield flag_entry(current)
+
+def flag_entry(merged):
+    #reasons joined the way log_moderation writes them
+    reasons = merged.pop("reasons")
+    merged["reason"] = "; ".join(reasons) if reasons else "NOT FLAGGED"
+    return merged
+
+def iter_entries(path, columns=None):
+    '''Entries of a file in any of the stored formats, reduced to `columns` if given'''
+    kind = detect_format(path)
+    if kind == "log":
+        entries = iter_log(path)
+    elif kind == "jsonl":
+        entries = merge_flag_records(iter_jsonl(path))
+    else:
+        f = open(path, "r", encoding="utf-8")
+        entries = iter_json_array(f, ENTRIES_KEY if kind == "object" else None)
+
+    try:
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            yield entry if columns is None else {column: entry.get(column) for column in columns}
+    finally:
+        if kind in ("array", "object"):
+            f.close()
+
+def iter_chunks(source, columns=None, chunk_size=CHUNK_SIZE):
+    '''Lists of at most chunk_size entries from a file path or an EntryStore'''
+    if isinstance(source, str):
+        entries = iter_entries(source, columns)
+    else:
+        #a store already holds its entries in memory, only the copies are chunked
+        entries = (entry if columns is None else {column: entry.get(column) for column in columns}
+                   for entry in source.entries())
+    while True:
+        chunk = list(islice(entries, chunk_size))
+        if not chunk:
+            return
+        yield chunk
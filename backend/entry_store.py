@@ -0,0 +1,473 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from entry_reader import iter_entries
+from process_local import ProcessLocal, daemon_thread
+
+try:
+    import fcntl #file locks between processes (not available on windows)
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+#compact once at least this many records are dead (overwritten or deleted)
+#and they outnumber the live entries
+COMPACT_MIN_DEAD = 1000
+#how many records an index may fall behind before the background saver writes its snapshot
+SNAPSHOT_EVERY = 500
+#entries per line when the whole store is rewritten (migration/compaction)
+CHUNK_SIZE = 1000
+
+
+#base class for derived data (tag index, reply index, counters...) kept up to date by a store
+#subclasses implement reset/on_put/on_delete and to_snapshot/from_snapshot, the store takes care
+#of replaying its log and saving the snapshot together with the seq it reflects
+#snapshots are written by a background thread (EntryStore._save), never inside a put or a read:
+#to_snapshot runs with the store locked and must return a copy, the copy is written after the
+#lock is released
+class StoreIndex:
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self.store = None #set by EntryStore.add_index
+        self.seq = 0
+        self._unsaved = 0
+
+    def reset(self):
+        raise NotImplementedError
+
+    def on_put(self, entry):
+        raise NotImplementedError
+
+    def on_delete(self, entry):
+        raise NotImplementedError
+
+    def to_snapshot(self):
+        raise NotImplementedError
+
+    def from_snapshot(self, state):
+        raise NotImplementedError
+
+    def load(self):
+        self.reset()
+        self.seq = 0
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            self.from_snapshot(snapshot["state"])
+            self.seq = snapshot["seq"]
+        except Exception as e:
+            log.warning("Ignoring unreadable index snapshot %s: %s", self.snapshot_path, e)
+            self.reset()
+            self.seq = 0
+
+    def catch_up(self):
+        '''Deferred work to finish before a snapshot, runs without the store's lock'''
+
+    def checkpoint(self):
+        '''Capture the state to save (the store's lock is held), returns a function that writes it'''
+        self._unsaved = 0
+        if not self.snapshot_path:
+            return lambda: None
+        snapshot = {"seq": self.seq, "state": self.to_snapshot()}
+        return lambda: atomic_write_json(self.snapshot_path, snapshot)
+
+
+#append-only entry store: every change is one json line ({"seq", "op", ...}) appended and fsync'd,
+#the live entries are kept in memory keyed by id so reads never touch the disk
+class EntryStore:
+    def __init__(self, path, legacy_path=None, key="id"):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.key = key
+
+        self._entries = {} #id -> entry, in insertion order
+        self._indexes = []
+        self._seq = 0 #seq of the last applied record
+        self._base_seq = 0 #records up to here were folded into the file by a compaction
+        #the file applied so far, kept open: its inode can't be reused while it is, and once another
+        #process swaps in a compacted file this one is left with no links (st_nlink == 0)
+        self._file = None
+        self._offset = 0 #bytes of the file already applied
+        self._written = 0 #entry puts/deletes in the current file, to know how much is dead
+        self._loaded = False
+        self._stale = [] #indexes that have to be rebuilt once a reload finishes
+
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+        #False: this process never writes index snapshots (serve.py's web workers leave that to the
+        #refresher), they are only read at start
+        self.autosave = True
+        self._due = {} #indexes waiting for the saver, insertion-ordered set
+        self._save_wanted = threading.Event()
+        self._saver = daemon_thread(self._save_loop, "index-saver")
+        #one save at a time, so snapshots reach the disk in the order they were taken
+        self._save_lock = ProcessLocal(threading.Lock)
+
+        #index snapshots are also written every SNAPSHOT_EVERY records, this catches the rest
+        atexit.register(self.save_indexes)
+
+    #locking: a thread lock for this process plus an flock on <path>.lock for other processes
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                self._lock_file = open(self.path + ".lock", "a")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def add_index(self, index):
+        '''Attach derived data that should follow every put/delete of this store'''
+        with self._lock:
+            index.store = self
+            index.load()
+            self._indexes.append(index)
+            if self._loaded and index.seq != self._seq:
+                self._rebuild(index)
+
+    #reading the log
+    def _refresh(self):
+        '''Apply whatever was appended to the file since we last looked (by us or another process)'''
+        if not self._loaded:
+            self._loaded = True
+            if self.legacy_path and not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+                migrate(self.legacy_path, self)
+
+        if self._file is not None:
+            stat = os.fstat(self._file.fileno())
+            if stat.st_nlink and stat.st_size >= self._offset:
+                if stat.st_size > self._offset:
+                    self._read_from(self._offset)
+                return
+        if os.path.exists(self.path):
+            self._reload()
+
+    def _reload(self):
+        #the file is new to us (first load, or compacted by another process): start over
+        self._entries = {}
+        self._seq = 0
+        self._base_seq = 0
+        self._written = 0
+        self._offset = 0
+        self._open()
+        self._stale = []
+        self._read_from(0)
+
+        #indexes whose snapshot is older than the last compaction (or from another log) are rebuilt
+        for index in self._indexes:
+            if index in self._stale or index.seq < self._base_seq or index.seq > self._seq:
+                self._rebuild(index)
+        self._stale = []
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "rb")
+
+    def _read_from(self, offset):
+        fd = self._file.fileno()
+        if hasattr(os, "pread"):
+            #a forked process shares the open file, and so its position, with its parent
+            data = os.pread(fd, os.fstat(fd).st_size - offset, offset)
+        else:
+            self._file.seek(offset)
+            data = self._file.read()
+
+        #only whole lines, a writer in another process may be halfway through an append
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                log.warning("Skipping malformed line in %s: %s", self.path, e)
+                continue
+            self._apply(record)
+        self._offset = offset + end
+
+    def _apply(self, record):
+        seq = record.get("seq", self._seq + 1)
+        op = record.get("op")
+
+        if op == "meta":
+            self._base_seq = seq
+            self._seq = max(self._seq, seq)
+            #indexes that missed compacted records can't be caught up incrementally
+            self._stale.extend(index for index in self._indexes if index.seq < seq and index not in self._stale)
+            return
+
+        listeners = [index for index in self._indexes if index.seq < seq and index not in self._stale]
+        self._seq = seq #already the record's seq while the indexes see its entries
+
+        if op == "put":
+            for entry in record.get("entries", []):
+                entry_id = entry[self.key]
+                old = self._entries.get(entry_id)
+                self._entries[entry_id] = entry
+                self._written += 1
+                for index in listeners:
+                    if old is not None:
+                        index.on_delete(old)
+                    index.on_put(entry)
+        elif op == "del":
+            for entry_id in record.get("ids", []):
+                old = self._entries.pop(entry_id, None)
+                self._written += 1
+                if old is not None:
+                    for index in listeners:
+                        index.on_delete(old)
+
+        for index in listeners:
+            index.seq = seq
+            index._unsaved += 1
+            if index._unsaved >= SNAPSHOT_EVERY:
+                self._save_soon(index)
+
+    def _rebuild(self, index):
+        index.reset()
+        for entry in self._entries.values():
+            index.on_put(entry)
+        index.seq = self._seq
+        self._save_soon(index)
+
+    #writing the log
+    def _append(self, record):
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is None:
+            self._open()
+        self._offset += len(line)
+        self._apply(record)
+
+    def put(self, entry):
+        self.put_many([entry])
+
+    def put_many(self, entries):
+        '''Append new (or replacement) entries in one fsync'd write'''
+        entries = list(entries)
+        if not entries:
+            return
+        with self._locked():
+            self._refresh()
+            self._append({"seq": self._seq + 1, "op": "put", "entries": entries})
+            self._maybe_compact()
+
+    def delete(self, entry_id):
+        return self.delete_many([entry_id])
+
+    def delete_many(self, entry_ids):
+        '''Remove entries in one fsync'd write, returns the entries that were actually removed'''
+        with self._locked():
+            self._refresh()
+            removed = []
+            seen = set()
+            for entry_id in entry_ids:
+                if entry_id in self._entries and entry_id not in seen:
+                    seen.add(entry_id)
+                    removed.append(self._entries[entry_id])
+            if removed:
+                self._append({"seq": self._seq + 1, "op": "del", "ids": [e[self.key] for e in removed]})
+                self._maybe_compact()
+            return removed
+
+    def _maybe_compact(self):
+        dead = self._written - len(self._entries)
+        if dead >= COMPACT_MIN_DEAD and dead > len(self._entries):
+            self.compact()
+
+    def compact(self):
+        '''Rewrite the file with only the live entries, under a header that keeps the current seq'''
+        with self._locked():
+            self._refresh()
+            if self._file is not None:
+                #windows can't replace a file that is open
+                self._file.close()
+                self._file = None
+            write_log(self.path, list(self._entries.values()), self._seq)
+            self._open()
+            self._offset = os.fstat(self._file.fileno()).st_size
+            self._base_seq = self._seq
+            self._written = len(self._entries)
+            #snapshots older than the compaction would make every other process rebuild its indexes
+            for index in self._indexes:
+                self._save_soon(index)
+
+    #saving index snapshots
+    def _save_soon(self, index):
+        '''Hand the index to the background saver (the store's lock is held)'''
+        self._due[index] = None
+        if self.autosave:
+            self._saver.get()
+            self._save_wanted.set()
+
+    def _save_loop(self):
+        while True:
+            self._save_wanted.wait()
+            self._save_wanted.clear()
+            with self._lock:
+                due = list(self._due)
+            self._save(due)
+
+    def _save(self, indexes):
+        #the store is locked only while each index captures its state, never while it is written
+        with self._save_lock.get():
+            for index in indexes:
+                try:
+                    index.catch_up()
+                    with self._lock:
+                        self._due.pop(index, None)
+                        write = index.checkpoint()
+                    write()
+                except Exception:
+                    log.exception("Saving the %s snapshot of %s failed", type(index).__name__, self.path)
+
+    def save_indexes(self):
+        '''Write every snapshot that is behind now (at exit, before forking), waits for the saver'''
+        if not self.autosave:
+            return
+        with self._lock:
+            indexes = [index for index in self._indexes if index._unsaved or index in self._due]
+        self._save(indexes)
+
+    #reads
+    def refresh(self):
+        '''Apply what other processes appended (every read does this anyway)'''
+        with self._lock:
+            self._refresh()
+
+    @contextmanager
+    def reading(self):
+        '''Hold the store (and its indexes) still and up to date while reading several things'''
+        with self._lock:
+            self._refresh()
+            yield self
+
+    @property
+    def loaded(self):
+        '''Whether the log has been read into memory yet (it is on first use)'''
+        return self._loaded
+
+    def entries(self):
+        with self._lock:
+            self._refresh()
+            return list(self._entries.values())
+
+    def ids(self):
+        with self._lock:
+            self._refresh()
+            return list(self._entries)
+
+    def get(self, entry_id, default=None):
+        with self._lock:
+            self._refresh()
+            return self._entries.get(entry_id, default)
+
+    def __contains__(self, entry_id):
+        with self._lock:
+            self._refresh()
+            return entry_id in self._entries
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._entries)
+
+    @property
+    def seq(self):
+        '''Seq of the record being applied (for indexes, inside on_put/on_delete) or of the last one'''
+        return self._seq
+
+    @property
+    def version(self):
+        '''Changes every time the store is written, usable as a cache key'''
+        with self._lock:
+            self._refresh()
+            return self._seq
+
+
+@contextmanager
+def file_lock(path):
+    '''Exclusive lock on `path` between processes (flock, nothing on windows), not reentrant'''
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def temp_path(filepath):
+    #unique per process and thread, so two writers of the same file never share a temp file
+    return f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def atomic_write_json(filepath, data):
+    tmp = temp_path(filepath)
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filepath)
+
+def write_log(filepath, entries, seq):
+    '''Write a complete log file (header + entries) next to the old one and swap it in'''
+    tmp = temp_path(filepath)
+    with open(tmp, "w") as f:
+        f.write(json.dumps({"seq": seq, "op": "meta"}) + "\n")
+        for i in range(0, len(entries), CHUNK_SIZE):
+            f.write(json.dumps({"seq": seq, "op": "put", "entries": entries[i:i + CHUNK_SIZE]}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filepath)
+
+def read_legacy(filepath):
+    '''Entries from the old whole-file formats: {"entries": [...], "tag_dict": {...}} or a plain list'''
+    #parsed incrementally (entry_reader.py), the whole file is never held as one json document
+    try:
+        return list(iter_entries(filepath))
+    except Exception as e:
+        log.error("Error loading file %s: %s", filepath, e)
+        return []
+
+def migrate(legacy_path, store):
+    '''One-shot conversion of an old json file into the store's log (skipped if the log exists)'''
+    with store._locked():
+        if os.path.exists(store.path):
+            return 0
+        entries = [entry for entry in read_legacy(legacy_path) if entry.get(store.key)]
+        write_log(store.path, entries, 1 if entries else 0)
+        log.info("Migrated %d entries from %s to %s", len(entries), legacy_path, store.path)
+        return len(entries)
+
+
+#the two stores used by the app, paths are relative to the backend folder like the rest of the code
+raw_store = EntryStore("user-text.jsonl", legacy_path="user-text.json")
+log_store = EntryStore("content_log_cleaned.jsonl", legacy_path="content_log_cleaned.json")
+
+if __name__ == "__main__":
+    #python entry_store.py migrates both files (if needed) and compacts the logs
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for store in (raw_store, log_store):
+        print(f"{store.path}: {len(store)} entries")
+        store.compact()
@@ -0,0 +1,84 @@
+import importlib.util
+import logging
+import os
+from functools import lru_cache
+
+#transformers (and torch with it) is imported by the loaders, not here: it takes seconds and
+#most of the backend never needs it
+#how the moderation models run on the cpu:
+#   torch  full precision pytorch (the original setup)
+#   int8   pytorch with dynamic int8 quantization of the linear layers (no extra dependencies)
+#   onnx   exported to onnx and run by onnx runtime (needs `pip install optimum[onnxruntime]`)
+BACKENDS = ("torch", "int8", "onnx")
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+#exported onnx models are kept here so the export only happens once per model
+ONNX_DIR = os.environ.get("ONNX_DIR", "onnx_models")
+
+log = logging.getLogger(__name__)
+
+def load_torch(model_name):
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+    return model, tokenizer
+
+def load_int8(model_name):
+    import torch
+
+    model, tokenizer = load_torch(model_name)
+    #weights of every nn.Linear stored as int8, activations quantized on the fly per batch
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, tokenizer
+
+def load_onnx(model_name):
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import AutoTokenizer
+
+    export_path = os.path.join(ONNX_DIR, model_name.replace("/", "__"))
+    if os.path.isdir(export_path):
+        model = ORTModelForSequenceClassification.from_pretrained(export_path)
+        tokenizer = AutoTokenizer.from_pretrained(export_path)
+    else:
+        log.info("Exporting %s to onnx, this only happens once", model_name)
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model.save_pretrained(export_path)
+        tokenizer.save_pretrained(export_path)
+    return model, tokenizer
+
+LOADERS = {"torch": load_torch, "int8": load_int8, "onnx": load_onnx}
+#the module each backend needs, looked up without importing it
+REQUIRES = {"torch": "torch", "int8": "torch", "onnx": "optimum.onnxruntime"}
+
+@lru_cache(maxsize=None)
+def resolve_backend(backend=None):
+    '''The backend models will run on: the configured one, or torch when its dependency is missing'''
+    backend = backend or INFERENCE_BACKEND
+    if backend not in LOADERS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    try:
+        found = importlib.util.find_spec(REQUIRES[backend]) is not None
+    except ModuleNotFoundError:
+        found = False
+    if not found and backend != "torch":
+        #a missing optional dependency should not take moderation down
+        log.warning("%s backend unavailable (%s is not installed), falling back to torch", backend, REQUIRES[backend])
+        return "torch"
+    return backend
+
+def load_text_classifier(task, model_name, backend=None):
+    '''(transformers pipeline for `model_name`, the backend it actually runs on)'''
+    from transformers import pipeline
+
+    backend = resolve_backend(backend)
+    try:
+        model, tokenizer = LOADERS[backend](model_name)
+    except ImportError as e:
+        if backend == "torch":
+            raise
+        log.warning("%s backend failed to load (%s), falling back to torch", backend, e)
+        backend = "torch"
+        model, tokenizer = load_torch(model_name)
+    return pipeline(task, model=model, tokenizer=tokenizer), backend
@@ -0,0 +1,180 @@
+import logging
+import os
+import re
+import threading
+from collections import deque
+
+#same punctuation table and stop words clean() uses
+from text_normalizer import PUNCTUATION, stop_words
+
+log = logging.getLogger(__name__)
+
+MODERATION_LIST = './moderation_list.txt'
+
+#common character swaps used to get words past a filter (h3ll0, a$$, @ss, sh!t ...)
+LEET = str.maketrans({'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't',
+                      '@': 'a', '$': 's', '!': 'i', '|': 'l', '+': 't'})
+NOT_LETTERS = re.compile(r'[^a-z]')
+REPEATS = re.compile(r'(.)\1{2,}') #3 or more of the same letter in a row
+
+
+def variants(token):
+    '''De-obfuscated spellings of a raw (lowercased) token, in the order they should be tried'''
+    letters = NOT_LETTERS.sub('', token.translate(LEET))
+    if not letters:
+        return []
+    found = [letters, REPEATS.sub(r'\1\1', letters), REPEATS.sub(r'\1', letters)]
+    return list(dict.fromkeys(found))
+
+
+#aho-corasick automaton over word tokens: finds every multi-word phrase of the list
+#in one left-to-right pass over the text, whatever the number of phrases
+class PhraseAutomaton:
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        #every word used in some phrase
+        self.tokens = frozenset(token for phrase in phrases for token in phrase.split())
+
+        for phrase in phrases:
+            node = 0
+            for token in phrase.split():
+                if token not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[node][token] = len(self.goto) - 1
+                node = self.goto[node][token]
+            self.out[node].append(phrase)
+
+        #breadth first to set the failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find(self, tokens):
+        '''(end position, phrase) for every phrase occurrence in a token list'''
+        matches = []
+        node = 0
+        for i, token in enumerate(tokens):
+            while node and token not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(token, 0)
+            for phrase in self.out[node]:
+                matches.append((i, phrase))
+        return matches
+
+
+#the moderation list compiled once: a set for single words and an automaton for phrases,
+#reloaded automatically when moderation_list.txt changes on disk
+class KeywordMatcher:
+    def __init__(self, filepath=MODERATION_LIST):
+        self.filepath = filepath
+        self.words = frozenset()
+        self.automaton = PhraseAutomaton([])
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _check_reload(self):
+        try:
+            mtime = os.stat(self.filepath).st_mtime_ns
+        except OSError as e:
+            log.error("Moderation list unavailable: %s", e)
+            return False
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._load(mtime)
+        return True
+
+    def _load(self, mtime):
+        words = set()
+        phrases = set()
+        with open(self.filepath, 'r') as file:
+            for line in file:
+                #normalised like the text it is matched against
+                term = ' '.join(line.lower().translate(PUNCTUATION).split())
+                if not term:
+                    continue
+                if ' ' in term:
+                    phrases.add(term)
+                else:
+                    words.add(term)
+        self.words = frozenset(words)
+        self.automaton = PhraseAutomaton(sorted(phrases))
+        self._mtime = mtime
+
+    @property
+    def version(self):
+        '''Changes whenever the moderation list is reloaded'''
+        self._check_reload()
+        return self._mtime
+
+    def scan(self, text):
+        '''Flagged keywords of one text, in the order they appear (repeats included)'''
+        if not isinstance(text, str) or not self._check_reload():
+            return []
+        return self._scan(text, self.words, self.automaton)
+
+    def scan_many(self, texts):
+        '''Flagged keywords for many texts, the list is checked/compiled once for the whole batch'''
+        if not self._check_reload():
+            return [[] for _ in texts]
+        words, automaton = self.words, self.automaton
+        return [self._scan(text, words, automaton) if isinstance(text, str) else [] for text in texts]
+
+    @staticmethod
+    def _scan(text, words, automaton):
+        raw_tokens = text.lower().split()
+        stop = stop_words()
+        tokens = []
+        decoded = []
+        hits = []
+
+        for raw in raw_tokens:
+            token = raw.translate(PUNCTUATION)
+            if not token:
+                continue
+            position = len(tokens)
+            tokens.append(token)
+
+            #single words: a set lookup per token, stop words are ignored like clean() does
+            if token in stop:
+                decoded.append(token)
+                continue
+            if token in words:
+                hits.append((position, token))
+                decoded.append(token)
+                continue
+            if token in automaton.tokens:
+                decoded.append(token)
+                continue
+
+            #not a known word as written, try the de-obfuscated spellings
+            spellings = variants(raw)
+            match = next((v for v in spellings if v in words), None)
+            if match:
+                hits.append((position, match))
+                decoded.append(match)
+            else:
+                decoded.append(next((v for v in spellings if v in automaton.tokens), token))
+
+        #phrases on the plain tokens, and on the de-obfuscated ones if any token changed
+        phrase_hits = set(automaton.find(tokens))
+        if decoded != tokens:
+            phrase_hits.update(automaton.find(decoded))
+        hits.extend(phrase_hits)
+
+        hits.sort(key=lambda hit: hit[0])
+        return [keyword for _, keyword in hits]
+
+
+matcher = KeywordMatcher()
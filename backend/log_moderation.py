@@ -1,30 +1,27 @@
-import json 
-from datetime import datetime as time 
+import logging
 from sentimental_analysis import clean 
-import os
+from entry_store import log_store
+from metrics import STAGE_SECONDS
 
-def log_content(entry, reasons): 
+log = logging.getLogger(__name__)
+
+#moderation records are appended to content_log_cleaned.jsonl (migrated from content_log_cleaned.json)
+CONTENT_LOG = log_store
+
+#the content log line for a moderated entry
+def log_record(entry, reasons):
     log_entry = entry.copy()
     log_entry["cleaned_text"] = clean(entry['text'])
     log_entry["reason"] = "; ".join(reasons) if reasons else "NOT FLAGGED"
- 
-    CONTENT_LOG = "content_log_cleaned.json"
+    return log_entry
 
-    #double checking file is correct format 
-    if os.path.exists(CONTENT_LOG): 
-        try: 
-            with open(CONTENT_LOG, 'r') as f: 
-                data = json.load(f) 
-        except Exception:
-            data = [] 
-    else: 
-        
-        data = []
+def log_content(entry, reasons): 
+    log_entry = log_record(entry, reasons)
 
-    data.append(log_entry) 
+    #one fsync'd line per entry, the store serialises writers across threads and processes
     try: 
-        with open(CONTENT_LOG, 'w') as f: 
-            json.dump(data, f, indent =2)
+        with STAGE_SECONDS.time(stage="log_write"):
+            CONTENT_LOG.put(log_entry)
     except Exception as e: 
-        print(f"Unable to write content log: {e}")
-
+        log.error("Unable to write content log: %s", e)
+        raise
@@ -0,0 +1,161 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+#process-wide metrics, exposed in prometheus' text format by /metrics
+#counters and histograms are updated where the work happens, gauges are read when scraped
+
+#latency buckets in seconds, from a cache hit up to a cold model load
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def label_text(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+def number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {} #label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        '''(suffix, label names, label values, value) for every exposed line'''
+        with self._lock:
+            return [("", self.labels, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{label_text(names, values)} {number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+#either set() directly or given a function that returns {label values: value} when scraped
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        return [("", self.labels, tuple(str(v) for v in key), value) for key, value in self.collect().items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - t0, **labels)
+
+    def samples(self):
+        names = self.labels + ("le",)
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["counts"]):
+                    cumulative += count
+                    samples.append(("_bucket", names, key + (number(bound),), cumulative))
+                samples.append(("_bucket", names, key + ("+Inf",), state["count"]))
+                samples.append(("_sum", self.labels, key, state["sum"]))
+                samples.append(("_count", self.labels, key, state["count"]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, cls, name, *args, **kwargs):
+        #asking twice for the same name returns the same metric (modules can be re-imported)
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self._add(Gauge, name, help, labels, collect=collect)
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._add(Histogram, name, help, labels, buckets)
+
+    def render(self):
+        '''Every metric in the prometheus text exposition format (version 0.0.4)'''
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+#the stages of a submission, shared by the modules that do them
+STAGE_SECONDS = metrics.histogram("moderation_stage_seconds",
+                                  "Seconds per call of each submission stage (inference runs per batch)", ["stage"])
+MODERATION_SECONDS = metrics.histogram("moderation_seconds", "Seconds from queueing an entry until it is logged")
+MODERATED = metrics.counter("moderated_entries_total", "Entries through the moderation pipeline by outcome", ["result"])
+FLAGGED = metrics.counter("flagged_entries_total", "Flagged entries by reason", ["reason"])
+CLASSIFICATION_ERRORS = metrics.counter("classification_errors_total", "Texts a model could not classify", ["model"])
+CHART_SECONDS = metrics.histogram("chart_render_seconds", "Seconds to draw each dashboard chart", ["chart"])
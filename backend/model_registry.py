@@ -0,0 +1,76 @@
+import threading
+from time import time
+
+
+#process-wide registry of the moderation models
+#loaders are registered by name and only called the first time a model is needed,
+#after that every caller gets the same pipeline object back
+class ModelRegistry:
+    def __init__(self):
+        self._loaders = {}
+        self._versions = {}
+        self._models = {}
+        self._load_times = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, loader, version=None):
+        #version identifies the weights/labels a loader produces (cached results are keyed by it)
+        #a loader returning (model, version) replaces it with what it really loaded
+        with self._lock:
+            self._loaders[name] = loader
+            self._versions[name] = version
+
+    def version(self, name):
+        return self._versions.get(name)
+
+    def get(self, name):
+        #fast path, the model is already loaded
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            #another thread may have loaded it while we were waiting for the lock
+            if name not in self._models:
+                if name not in self._loaders:
+                    raise KeyError(f"No model registered under the name: {name}")
+                t0 = time()
+                model = self._loaders[name]()
+                if isinstance(model, tuple):
+                    model, self._versions[name] = model
+                self._models[name] = model
+                self._load_times[name] = time() - t0
+            return self._models[name]
+
+    def warm_up(self, names=None):
+        '''Load every registered model (or only the given names) ahead of the first request'''
+        for name in names or list(self._loaders):
+            self.get(name)
+        return dict(self._load_times)
+
+    def unload(self, name=None):
+        '''Drop one model, or all of them when no name is given, so the memory can be freed'''
+        with self._lock:
+            if name is None:
+                self._models.clear()
+                self._load_times.clear()
+            else:
+                self._models.pop(name, None)
+                self._load_times.pop(name, None)
+
+    def reload(self, name=None):
+        self.unload(name)
+        return self.warm_up([name] if name else None)
+
+    def status(self):
+        return {
+            name: {
+                "loaded": name in self._models,
+                "version": self._versions.get(name),
+                "load_seconds": self._load_times.get(name)
+            }
+            for name in self._loaders
+        }
+
+
+registry = ModelRegistry()
@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter
+
+from batching import analyze, analyze_async #batched sentiment/toxicity inference
+from sentimental_analysis import flag_keywords as flag
+from log_moderation import log_content
+from render_scheduler import render_scheduler
+from process_local import ProcessLocal
+from metrics import MODERATION_SECONDS, MODERATED, FLAGGED
+
+log = logging.getLogger(__name__)
+
+#threads that flag keywords and write classified entries to the content log, classification
+#itself waits in the batching scheduler without holding a thread, so a burst of submits fills
+#whole batches (up to BATCH_MAX_SIZE) however small this is
+WORKERS = int(os.environ.get("MODERATION_WORKERS", "4"))
+#states kept for /status, finished entries are answered from the content log instead
+MAX_STATUS = 10000
+#redraw the dashboard pngs after new entries are logged, with 0 they are only drawn on demand
+#(/analytics/<name>/png) and the dashboard data comes from the json endpoints
+RENDER_ON_WRITE = os.environ.get("RENDER_ON_WRITE", "1") == "1"
+
+#moderation states an entry goes through after /submit
+QUEUED = "queued"
+CLASSIFYING = "classifying"
+DONE = "done"
+ERROR = "error"
+
+#builds the full moderation record for a raw entry (same fields that used to be built in app.submit_entry)
+def moderate_entry(raw_entry):
+    text = raw_entry["text"]
+
+    #perform analysis of sentiment and toxicity for potential flagging
+    analysis = analyze(text)
+    #catch flagged words, gets a list of flagged words
+    flags = flag(text)
+    return moderation_record(raw_entry, analysis, flags)
+
+#the record and flag reasons for one entry once its analysis and keywords are known
+#(backfill.py computes those for whole batches and builds the same records with this)
+def moderation_record(raw_entry, analysis, flags):
+    is_flagged = bool(flags or analysis['sentiment'] == 'NEGATIVE' or analysis['toxicity'] == 'toxic')
+
+    new_entry = dict(raw_entry)
+    new_entry.update({
+        'sentiment': analysis['sentiment'],
+        'toxicity': analysis['toxicity'],
+        'keywords': flags,
+        'flagged': is_flagged
+    })
+
+    #specify reasons for flagging here, returns empty list if nothing is flagged
+    reasons = []
+    if new_entry['keywords']:
+        reasons.append('KEYWORD: ' + ", ".join(new_entry['keywords']))
+    if new_entry['sentiment'] == 'NEGATIVE':
+        reasons.append('SENTIMENT: ' + new_entry['sentiment'])
+    if new_entry['toxicity'] == 'TOXIC':
+        reasons.append('TOXICITY: ' + new_entry['toxicity'])
+
+    return new_entry, reasons
+
+
+#background pipeline: classify -> log -> refresh dashboard, the request thread only persists the raw entry
+#an entry's status is dropped once it is logged (the content log says it is done), queued and failed
+#ones are kept up to MAX_STATUS, oldest dropped first
+class ModerationPipeline:
+    def __init__(self, workers=WORKERS, render_on_write=RENDER_ON_WRITE, max_status=MAX_STATUS):
+        self.workers = workers
+        self.render_on_write = render_on_write
+        self.max_status = max_status
+        self._status = OrderedDict()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0 #enqueued and not finished yet
+        self._pool = ProcessLocal(lambda: ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="moderation"))
+
+    def _set_state(self, entry_id, state, error=None):
+        with self._lock:
+            if state == DONE:
+                self._status.pop(entry_id, None)
+                return
+            self._status[entry_id] = {
+                "state": state,
+                "updated": datetime.now().isoformat(),
+                "error": error
+            }
+            self._status.move_to_end(entry_id)
+            while len(self._status) > self.max_status:
+                self._status.popitem(last=False)
+
+    def status(self, entry_id):
+        with self._lock:
+            status = self._status.get(entry_id)
+            return dict(status) if status else None
+
+    def enqueue(self, raw_entry):
+        '''Queue a raw entry that has already been saved, returns immediately'''
+        queued = perf_counter()
+        self._set_state(raw_entry["id"], QUEUED)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            analysis = analyze_async(raw_entry["text"])
+        except Exception as e:
+            self._finish(raw_entry, None, queued, e)
+            return
+        self._set_state(raw_entry["id"], CLASSIFYING)
+        #the rest runs in the pool once the entry's batch is done, never on the batch worker
+        analysis.add_done_callback(lambda future: self._submit(self._finish, raw_entry, future, queued))
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            self._pool.get().submit(fn, *args)
+
+    def _finish(self, raw_entry, analysis, queued=None, error=None):
+        try:
+            self._process(raw_entry, analysis, queued, error)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def _process(self, raw_entry, analysis, queued=None, error=None):
+        entry_id = raw_entry["id"]
+        try:
+            if error is not None:
+                raise error
+            #sentiment/toxicity from the entry's batch, flagged words from the moderation list
+            new_entry, reasons = moderation_record(raw_entry, analysis.result(), flag(raw_entry["text"]))
+
+            #create a log that includes all details about flags
+            log_content(new_entry, reasons)
+        except Exception as e:
+            log.exception("Moderation of %s failed", entry_id)
+            MODERATED.inc(result="error")
+            self._set_state(entry_id, ERROR, error=str(e))
+            return
+
+        if queued is not None:
+            MODERATION_SECONDS.observe(perf_counter() - queued)
+        MODERATED.inc(result="flagged" if new_entry["flagged"] else "not_flagged")
+        for reason in reasons:
+            #"KEYWORD: ...", "SENTIMENT: ...", "TOXICITY: ..."
+            FLAGGED.inc(reason=reason.split(":", 1)[0].lower())
+        self._set_state(entry_id, DONE)
+        self.request_refresh()
+
+    def request_refresh(self):
+        #dashboard refreshes are debounced and coalesced by the render scheduler
+        if self.render_on_write:
+            render_scheduler.request_refresh()
+
+    def shutdown(self):
+        '''Finish the entries already queued in this process, for a clean stop (serve.py)'''
+        with self._lock:
+            #entries still waiting for their batch are not in the pool yet
+            while self._in_flight:
+                self._idle.wait()
+            pool = self._pool.current()
+            self._pool.clear()
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+pipeline = ModerationPipeline()
@@ -0,0 +1,83 @@
+from bisect import bisect_left, bisect_right, insort
+
+from entry_store import StoreIndex, raw_store
+
+#largest page /get-data will return, whatever the client asks for
+MAX_LIMIT = 500
+DEFAULT_LIMIT = 100
+
+#cursors are "<timestamp>|<id>" of the last entry a client has seen
+def encode_cursor(entry):
+    return f"{entry['timestamp']}|{entry['id']}"
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    timestamp, sep, entry_id = cursor.partition("|")
+    if not sep:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return (timestamp, entry_id)
+
+
+#entries sorted by (timestamp, id) so a page can start anywhere with a binary search
+#instead of walking the whole archive
+class OrderIndex(StoreIndex):
+    def reset(self):
+        self.keys = []
+
+    def on_put(self, entry):
+        key = (entry.get("timestamp", ""), entry["id"])
+        #new posts almost always go at the end
+        if not self.keys or self.keys[-1] < key:
+            self.keys.append(key)
+        else:
+            insort(self.keys, key)
+
+    def on_delete(self, entry):
+        key = (entry.get("timestamp", ""), entry["id"])
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def to_snapshot(self):
+        return [list(key) for key in self.keys]
+
+    def from_snapshot(self, state):
+        self.keys = [tuple(key) for key in state]
+
+    def ids_before(self, timestamp):
+        '''Ids of every entry with a timestamp earlier than the given one'''
+        with self.store.reading():
+            end = bisect_left(self.keys, (timestamp,))
+            return [entry_id for _, entry_id in self.keys[:end]]
+
+    def page(self, cursor=None, since=None, limit=DEFAULT_LIMIT, match=None):
+        '''One page of entries.
+        Default: newest first, older than `cursor` when given.
+        since: oldest first, only entries newer than `since` (delta mode).
+        match: optional filter function, entries failing it are skipped.
+        Returns (entries, next_cursor), next_cursor is None on the last page'''
+        with self.store.reading():
+            keys = self.keys
+            if since is not None:
+                positions = range(bisect_right(keys, since), len(keys))
+            else:
+                end = bisect_left(keys, cursor) if cursor is not None else len(keys)
+                positions = range(end - 1, -1, -1)
+
+            entries = []
+            next_cursor = None
+            for i in positions:
+                entry = self.store.get(keys[i][1])
+                if entry is None or (match and not match(entry)):
+                    continue
+                if len(entries) == limit:
+                    #there is at least one more match, so hand out a cursor to continue from
+                    next_cursor = encode_cursor(entries[-1])
+                    break
+                entries.append(entry)
+            return entries, next_cursor
+
+
+order_index = OrderIndex("order_index.json")
+raw_store.add_index(order_index)
@@ -0,0 +1,40 @@
+import os
+import threading
+
+def cpu_count():
+    '''Cpus this process may run on (containers often allow fewer than os.cpu_count())'''
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return cpus or 1
+
+
+#a thread or pool owned by the process that made it: a forked child inherits the object but none
+#of its threads (serve.py forks the preloaded app), so get() makes a new one in each process that
+#uses it, and again if `alive` says the old one stopped
+class ProcessLocal:
+    def __init__(self, factory, alive=None):
+        self.factory = factory
+        self.alive = alive
+        self._value = None
+        self._pid = None
+
+    def get(self):
+        if self._value is None or self._pid != os.getpid() or (self.alive and not self.alive(self._value)):
+            self._pid = os.getpid()
+            self._value = self.factory()
+        return self._value
+
+    def current(self):
+        '''The one made by this process, None if there is none yet'''
+        return self._value if self._pid == os.getpid() else None
+
+    def clear(self):
+        self._value = None
+        self._pid = None
+
+def daemon_thread(target, name):
+    '''A daemon thread running `target`, started by get() in every process that needs it'''
+    def start():
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
+    return ProcessLocal(start, alive=threading.Thread.is_alive)
@@ -0,0 +1,104 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+
+from charts import timed_render
+from metrics import CHART_SECONDS
+from process_local import ProcessLocal, cpu_count
+
+log = logging.getLogger(__name__)
+
+#number of chart worker processes, 0 = one per chart up to the cpu count, 1 = draw in the calling thread
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "0"))
+#charts on the dashboard, the most that can be drawn at the same time
+MAX_CHARTS = 6
+
+def default_workers():
+    return min(MAX_CHARTS, cpu_count())
+
+
+#draws independent charts in a pool of worker processes
+#each chart is handed its slice of one snapshot of the aggregates, taken once by the caller,
+#so workers never touch the stores and never see data change halfway through a refresh
+class RenderEngine:
+    def __init__(self, workers=RENDER_WORKERS):
+        self.workers = workers or default_workers()
+        #spawned (not forked) workers: the server process is multi-threaded and only charts.py is needed
+        self._pool = ProcessLocal(lambda: ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")))
+        self._lock = threading.Lock()
+        self.last_timings = {}
+        self.last_wall = 0.0
+
+    def _render_serial(self, charts):
+        timings = {}
+        for output_name, data in charts.items():
+            try:
+                timings[output_name] = timed_render(output_name, data)
+            except Exception:
+                log.exception("Rendering %s failed", output_name)
+        return timings
+
+    def _render_parallel(self, charts):
+        timings = {}
+        with self._lock:
+            pool = self._pool.get()
+        futures = {pool.submit(timed_render, output_name, data): output_name for output_name, data in charts.items()}
+        for future in as_completed(futures):
+            output_name = futures[future]
+            try:
+                timings[output_name] = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception:
+                log.exception("Rendering %s failed", output_name)
+        return timings
+
+    def render(self, charts):
+        '''Draw {output_name: data}, returns {output_name: seconds} for the charts that were written'''
+        if not charts:
+            return {}
+        t0 = perf_counter()
+        if self.workers <= 1 or len(charts) == 1:
+            timings = self._render_serial(charts)
+        else:
+            try:
+                timings = self._render_parallel(charts)
+            except BrokenProcessPool:
+                #a worker died (e.g. killed), start a fresh pool next time and finish this refresh here
+                log.warning("Render pool broke, drawing charts in-process")
+                with self._lock:
+                    self._pool.clear()
+                timings = self._render_serial(charts)
+
+        wall = perf_counter() - t0
+        with self._lock:
+            self.last_timings = timings
+            self.last_wall = wall
+        for output_name, seconds in timings.items():
+            CHART_SECONDS.observe(seconds, chart=output_name)
+        log.info("Rendered %d chart(s) in %0.3fs (%s)", len(timings), wall,
+                 ", ".join("%s %0.3fs" % (name, seconds) for name, seconds in sorted(timings.items())))
+        return timings
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "last_wall_s": self.last_wall,
+                "last_chart_s": dict(self.last_timings),
+                "last_sum_s": sum(self.last_timings.values())
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool = self._pool.current()
+            if pool is not None:
+                pool.shutdown()
+            self._pool.clear()
+
+
+render_engine = RenderEngine()
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import logging
+import threading
+from datetime import datetime
+from time import sleep
+
+from charts import STATIC_PATH
+from render_engine import render_engine
+from entry_store import atomic_write_json, file_lock
+from process_local import daemon_thread
+
+log = logging.getLogger(__name__)
+
+#refresh requests arriving within this many seconds of the first one are rendered together
+DEBOUNCE = float(os.environ.get("RENDER_DEBOUNCE", "2.0"))
+#the dashboard reads this to know which images changed (name -> version)
+MANIFEST = os.path.join(STATIC_PATH, "manifest.json")
+
+def fingerprint(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+#coalescing render scheduler for the admin dashboard images
+#any number of request_refresh() calls inside the debounce window become one refresh, and a
+#refresh only re-draws the charts whose input data changed since they were last drawn
+#refreshes are serialized across processes by a lock next to the manifest, so two server
+#processes never draw the same image at once and the second one finds the charts up to date
+#with serve.py only the refresher draws, the web workers set writer = False and serve the images it drew
+class RenderScheduler:
+    def __init__(self, debounce=DEBOUNCE, manifest_path=MANIFEST):
+        self.debounce = debounce
+        self.manifest_path = manifest_path
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock() #the worker and on-demand exports never draw at the same time
+        self._worker = daemon_thread(self._run, "render-scheduler")
+        self._manifest = None
+        self.writer = True
+
+        self.requests = 0
+        self.refreshes = 0
+        self.renders = 0
+
+    def request_refresh(self):
+        with self._lock:
+            self.requests += 1
+            self._worker.get()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            #let the rest of a burst arrive, then clear so later requests trigger another round
+            sleep(self.debounce)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                log.exception("Dashboard refresh failed")
+
+    def manifest(self):
+        if self._manifest is None:
+            try:
+                with open(self.manifest_path, "r") as f:
+                    self._manifest = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._manifest = {}
+        return self._manifest
+
+    def refresh(self, force=False, names=None):
+        '''Re-draw the charts (all, or just `names`) whose inputs changed, returns the names that were rendered'''
+        if not self.writer:
+            return []
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        with self._refresh_lock, file_lock(self.manifest_path + ".lock"):
+            #another process may have drawn (and rewritten the manifest) since we last read it
+            self._manifest = None
+            return self._refresh(force, names)
+
+    def _refresh(self, force, names):
+        #the dashboard data (with pandas, the topic model...) is imported by the first refresh
+        from content_analysis import chart_inputs
+
+        with self._lock:
+            self.refreshes += 1
+        manifest = dict(self.manifest())
+        changed, versions = {}, {}
+        for output_name, data in chart_inputs().items():
+            if names is not None and output_name not in names:
+                continue
+            version = fingerprint(data)
+            image = os.path.join(STATIC_PATH, output_name)
+            if not force and manifest.get(output_name, {}).get("version") == version and os.path.exists(image):
+                continue
+            changed[output_name] = data
+            versions[output_name] = version
+
+        #the changed charts are drawn in parallel, a chart that failed keeps its old version
+        timings = render_engine.render(changed)
+        rendered = [output_name for output_name in changed if output_name in timings]
+        for output_name in rendered:
+            manifest[output_name] = {"version": versions[output_name], "updated": datetime.now().isoformat()}
+
+        if rendered:
+            atomic_write_json(self.manifest_path, manifest)
+            self._manifest = manifest
+            with self._lock:
+                self.renders += len(rendered)
+        return rendered
+
+    def metrics(self):
+        with self._lock:
+            counts = {"requests": self.requests, "refreshes": self.refreshes, "renders": self.renders}
+        return {**counts, "engine": render_engine.metrics()}
+
+
+render_scheduler = RenderScheduler()
@@ -0,0 +1,45 @@
+from collections import deque
+
+from entry_store import StoreIndex, raw_store
+
+#reply tree: parent_id -> ids of its direct replies
+#kept up to date by the raw store and snapshotted to reply_index.json
+class ReplyIndex(StoreIndex):
+    def reset(self):
+        self.children = {}
+
+    def on_put(self, entry):
+        parent_id = entry.get("parent_id")
+        if parent_id:
+            self.children.setdefault(parent_id, {})[entry["id"]] = None
+
+    def on_delete(self, entry):
+        parent_id = entry.get("parent_id")
+        replies = self.children.get(parent_id)
+        if replies is not None:
+            replies.pop(entry["id"], None)
+            if not replies:
+                del self.children[parent_id]
+
+    def to_snapshot(self):
+        return {parent_id: list(ids) for parent_id, ids in self.children.items()}
+
+    def from_snapshot(self, state):
+        self.children = {parent_id: dict.fromkeys(ids) for parent_id, ids in state.items()}
+
+    def subtree(self, entry_ids):
+        '''The given ids plus every reply below them, breadth first and without recursion
+        so deep threads can't hit the recursion limit'''
+        with self.store.reading():
+            seen = dict.fromkeys(entry_ids)
+            queue = deque(seen)
+            while queue:
+                for child in self.children.get(queue.popleft(), {}):
+                    if child not in seen:
+                        seen[child] = None
+                        queue.append(child)
+            return list(seen)
+
+
+reply_index = ReplyIndex("reply_index.json")
+raw_store.add_index(reply_index)
@@ -0,0 +1,263 @@
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from entry_store import StoreIndex, raw_store, file_lock, temp_path, CHUNK_SIZE
+from text_normalizer import clean
+
+log = logging.getLogger(__name__)
+
+#title and tag matches count more than a word somewhere in the text
+FIELD_WEIGHTS = {"title": 2, "text": 1, "tags": 2}
+#bm25 parameters: term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+#a prefix matches at most this many terms (the ones in the most documents)
+MAX_EXPANSIONS = 50
+#the on-disk index is folded back into one base once it has this many appended segments
+MAX_SEGMENTS = 64
+
+def document_terms(entry):
+    '''term -> weighted count over the title, text and tags of an entry'''
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        value = entry.get(field)
+        if field == "tags":
+            value = " ".join(tag for tag in value or [] if isinstance(tag, str))
+        if not isinstance(value, str):
+            continue
+        for term in clean(value).split():
+            counts[term] += weight
+    return counts
+
+def query_terms(query, prefix=False):
+    '''(term, is_prefix) for each word of a query, "word*" (or the last word with prefix=True) matches as a prefix'''
+    words = query.split()
+    terms = []
+    for i, word in enumerate(words):
+        is_prefix = word.endswith("*") or (prefix and i == len(words) - 1)
+        for term in clean(word.rstrip("*")).split():
+            terms.append((term, is_prefix))
+    return terms
+
+
+#on-disk format: a jsonl file of segments, each {"seq", "docs": {id: {term: count}}, "deleted": [ids],
+#"pending": [ids]} with what changed since the previous one, a segment with "base" starts over
+#a snapshot only appends the documents indexed since the last one, so saving costs the same at
+#any archive size, the segments are folded into a new base (from the file, not from memory)
+#every MAX_SEGMENTS snapshots
+def read_segments(path):
+    '''(seq, {id: term counts}, pending ids, number of segments) from a segment file'''
+    with open(path, "r") as f:
+        segments = [json.loads(line) for line in f if line.strip()]
+    #another process may have appended an older snapshot after a newer one
+    segments.sort(key=lambda segment: segment["seq"])
+    seq, docs, pending = 0, {}, []
+    for segment in segments:
+        if segment.get("base"):
+            docs = {}
+        docs.update(segment.get("docs", {}))
+        for entry_id in segment.get("deleted", []):
+            docs.pop(entry_id, None)
+        if "pending" in segment:
+            pending = segment["pending"]
+        seq = segment["seq"]
+    return seq, docs, pending, len(segments)
+
+def base_lines(seq, docs, pending):
+    items = list(docs.items())
+    #in chunks, so reading it back never parses one huge json document
+    yield {"seq": seq, "base": True, "docs": dict(items[:CHUNK_SIZE]), "pending": pending}
+    for i in range(CHUNK_SIZE, len(items), CHUNK_SIZE):
+        yield {"seq": seq, "docs": dict(items[i:i + CHUNK_SIZE])}
+
+
+#bm25 full-text index over the raw entries (title, text, tags), normalized like everything else
+#with text_normalizer.clean: term -> {id: weighted count} plus each document's length
+#new and changed entries are only queued by the store and tokenized by the next search (or
+#before the next snapshot), so reading the archive never pays for the text cleaning
+class SearchIndex(StoreIndex):
+    def __init__(self, snapshot_path=None):
+        super().__init__(snapshot_path)
+        self._segments = 0 #segments in the file since its base
+        self._write_lock = threading.Lock()
+
+    def reset(self):
+        self.postings = {}
+        self.lengths = {} #id -> weighted number of terms
+        self.total_length = 0
+        self.terms = [] #sorted vocabulary, prefix lookups are a binary search
+        self.pending = {} #ids put since the last search, insertion-ordered set
+        self.changed = {} #id -> term counts (None once removed) since the last snapshot
+        self._rewrite = True #the next snapshot starts a new base
+
+    def on_put(self, entry):
+        self.pending[entry["id"]] = None
+
+    def on_delete(self, entry):
+        entry_id = entry["id"]
+        if entry_id in self.pending:
+            del self.pending[entry_id]
+            return
+        if self.lengths.pop(entry_id, None) is None:
+            return
+        self.changed[entry_id] = None
+        for term, count in document_terms(entry).items():
+            self.total_length -= count
+            ids = self.postings.get(term)
+            if ids is None:
+                continue
+            ids.pop(entry_id, None)
+            if not ids:
+                del self.postings[term]
+                i = bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+
+    #snapshots, see read_segments
+    def load(self):
+        self.reset()
+        self.seq = 0
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            seq, docs, pending, self._segments = read_segments(self.snapshot_path)
+            for entry_id, counts in docs.items():
+                self._add(entry_id, counts)
+            self.pending = dict.fromkeys(pending)
+            self.changed = {}
+            self.seq = seq
+            self._rewrite = False
+        except Exception as e:
+            log.warning("Ignoring unreadable search index %s: %s", self.snapshot_path, e)
+            self.reset()
+            self.seq = 0
+
+    def catch_up(self):
+        #the pending entries are tokenized without holding the store, and only added if they were
+        #not changed or deleted in the meantime
+        with self.store.reading():
+            todo = [(entry_id, self.store.get(entry_id)) for entry_id in self.pending]
+        counted = [(entry_id, entry, document_terms(entry)) for entry_id, entry in todo if entry is not None]
+        with self.store.reading():
+            for entry_id, entry, counts in counted:
+                if entry_id in self.pending and self.store.get(entry_id) is entry:
+                    del self.pending[entry_id]
+                    self._add(entry_id, counts)
+
+    def checkpoint(self):
+        self._unsaved = 0
+        if not self.snapshot_path:
+            return lambda: None
+        docs = {entry_id: counts for entry_id, counts in self.changed.items() if counts is not None}
+        if self._rewrite:
+            lines = list(base_lines(self.seq, docs, list(self.pending)))
+        else:
+            deleted = [entry_id for entry_id, counts in self.changed.items() if counts is None]
+            lines = [{"seq": self.seq, "docs": docs, "deleted": deleted, "pending": list(self.pending)}]
+        base, self._rewrite, self.changed = self._rewrite, False, {}
+        return lambda: self._write(lines, base)
+
+    def _write(self, lines, base):
+        with self._write_lock, file_lock(self.snapshot_path + ".lock"):
+            if base:
+                self._replace(lines)
+                return
+            with open(self.snapshot_path, "a") as f:
+                for line in lines:
+                    f.write(json.dumps(line) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._segments += 1
+            if self._segments > MAX_SEGMENTS:
+                seq, docs, pending, _ = read_segments(self.snapshot_path)
+                self._replace(base_lines(seq, docs, pending))
+
+    def _replace(self, lines):
+        tmp = temp_path(self.snapshot_path)
+        with open(tmp, "w") as f:
+            for line in lines:
+                f.write(json.dumps(line) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self._segments = 1
+
+    def _add(self, entry_id, counts):
+        for term, count in counts.items():
+            ids = self.postings.get(term)
+            if ids is None:
+                ids = self.postings[term] = {}
+                insort(self.terms, term)
+            ids[entry_id] = count
+        self.lengths[entry_id] = sum(counts.values())
+        self.total_length += self.lengths[entry_id]
+        self.changed[entry_id] = counts
+
+    def _index_pending(self):
+        for entry_id in self.pending:
+            entry = self.store.get(entry_id)
+            if entry is not None:
+                self._add(entry_id, document_terms(entry))
+        if self.pending:
+            self._unsaved += len(self.pending)
+            self.pending = {}
+
+    def expand(self, term):
+        '''Indexed terms starting with `term`, the MAX_EXPANSIONS most common ones'''
+        start = bisect_left(self.terms, term)
+        end = bisect_left(self.terms, term + "\uffff", start)
+        matches = self.terms[start:end]
+        if len(matches) > MAX_EXPANSIONS:
+            matches = heapq.nlargest(MAX_EXPANSIONS, matches, key=lambda t: len(self.postings[t]))
+        return matches
+
+    def _scores(self, terms):
+        #every query term adds its best bm25 score (over its prefix expansions) to the documents it occurs in
+        n = len(self.lengths)
+        average = self.total_length / n if n else 0
+        scores = Counter()
+        for term, is_prefix in terms:
+            best = {}
+            for match in self.expand(term) if is_prefix else [term]:
+                ids = self.postings.get(match)
+                if not ids:
+                    continue
+                idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+                for entry_id, count in ids.items():
+                    norm = K1 * (1 - B + B * self.lengths[entry_id] / average)
+                    score = idf * count * (K1 + 1) / (count + norm)
+                    if score > best.get(entry_id, 0):
+                        best[entry_id] = score
+            scores.update(best)
+        return scores
+
+    def search(self, query, prefix=False, match=None, offset=0, limit=20):
+        '''Entries matching any term of `query`, best bm25 score first.
+        match: optional filter function, entries failing it are skipped.
+        Returns (total, [(score, entry), ...]) for the requested page'''
+        terms = query_terms(query, prefix)
+        self.catch_up()
+        with self.store.reading():
+            #whatever arrived while catching up
+            self._index_pending()
+            if not terms:
+                return 0, []
+            hits = []
+            for entry_id, score in self._scores(terms).items():
+                entry = self.store.get(entry_id)
+                if entry is None or (match and not match(entry)):
+                    continue
+                hits.append((score, entry_id, entry))
+            #only the top offset+limit are sorted, ties go to the newer entry
+            top = heapq.nlargest(offset + limit, hits, key=lambda hit: (hit[0], hit[2].get("timestamp") or ""))
+            return len(hits), [(score, entry) for score, _, entry in top[offset:]]
+
+
+search_index = SearchIndex("search_index.jsonl")
+raw_store.add_index(search_index)
@@ -8,110 +8,213 @@
 # 
 # ⚠️ This is a critical prototype: the goal is not perfect classification, but to reveal how these tools function, misfire, and shape online discourse.
 
-from transformers import pipeline
-import pandas as pd
-import re
-import string
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-import json 
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-
-
-def get_sentiment_classifier():
-    model_name = "cardiffnlp/twitter-roberta-base-sentiment"
-    
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-    return pipeline('sentiment-analysis', model=model, tokenizer = tokenizer)
-
-def get_toxicity_classifier():
-    #uncoment this to get all labels 
-    # return pipeline('text-classification', model='unitary/toxic-bert', return_all_scores=True)
-    return pipeline('text-classification', model='unitary/toxic-bert')
-
-def analyze_sentiment_toxicity(text): 
-    LABELS = {"LABEL_0": "NEGATIVE",
+import logging
+from model_registry import registry
+from inference_backends import load_text_classifier, resolve_backend
+from keyword_matcher import matcher
+import text_normalizer
+from time import perf_counter
+from classification_cache import classification_cache, cache_key
+from text_windows import split_windows
+from metrics import STAGE_SECONDS, CLASSIFICATION_ERRORS
+
+log = logging.getLogger(__name__)
+
+SENTIMENT_MODEL = "cardiffnlp/twitter-roberta-base-sentiment"
+TOXICITY_MODEL = "unitary/toxic-bert"
+#windows of one forward pass when long texts are split up
+WINDOW_BATCH_SIZE = 32
+#bump when the label mapping/aggregation below changes, cached labels of the old mapping are then ignored
+LABEL_VERSION = 2
+
+
+#backend: torch, int8 or onnx (INFERENCE_BACKEND, see inference_backends.py)
+#both return (pipeline, the backend it really loaded on)
+def get_sentiment_classifier(backend=None):
+    return load_text_classifier('sentiment-analysis', SENTIMENT_MODEL, backend)
+
+def get_toxicity_classifier(backend=None):
+    return load_text_classifier('text-classification', TOXICITY_MODEL, backend)
+
+#the backend is part of the version since quantized models can label a few texts differently
+def model_version(model_name, backend):
+    return f"{model_name}:{backend}@{LABEL_VERSION}"
+
+def versioned(loader, model_name):
+    #the registry loader, versioned by the backend that actually loaded
+    def load():
+        classifier, backend = loader()
+        return classifier, model_version(model_name, backend)
+    return load
+
+#models are built once per process and shared, see model_registry.py
+registry.register("sentiment", versioned(get_sentiment_classifier, SENTIMENT_MODEL),
+                  version=model_version(SENTIMENT_MODEL, resolve_backend()))
+registry.register("toxicity", versioned(get_toxicity_classifier, TOXICITY_MODEL),
+                  version=model_version(TOXICITY_MODEL, resolve_backend()))
+
+LABELS = {"LABEL_0": "NEGATIVE",
     "LABEL_1": "NEUTRAL",
     "LABEL_2": "POSITIVE",
     "LABEL_3": "MIXED",
     }
 
+def sentiment_label(output):
+    return LABELS[output['label']]
+
+def toxicity_label(output):
+    label = output['label']
+    score = output['score']
+
+    # Example mapping - adjust based on your model
+    if label == "toxic" and score > 0.7:
+        return "TOXIC"
+    return "NON_TOXIC"
+
+#long texts are classified as overlapping windows (text_windows.py), a window's output is
+#either one {label, score} or a list of them (all labels), these turn the windows of one text
+#back into a single label
+def window_scores(output):
+    if isinstance(output, dict):
+        return {output['label']: output['score']}
+    return {item['label']: item['score'] for item in output}
+
+def sentiment_aggregate(outputs, weights):
+    #length-weighted average of each label's score over the windows
+    totals = {}
+    for output, weight in zip(outputs, weights):
+        for label, score in window_scores(output).items():
+            totals[label] = totals.get(label, 0.0) + score * weight
+    best = max(totals, key=totals.get)
+    return sentiment_label({'label': best, 'score': totals[best] / sum(weights)})
+
+def toxicity_aggregate(outputs, weights):
+    #a post is as toxic as its most toxic window
+    score = max(window_scores(output).get('toxic', 0.0) for output in outputs)
+    return toxicity_label({'label': 'toxic', 'score': score})
+
+def classify_batch(name, texts, aggregate):
+    '''Run a list of texts through one registered pipeline as a single padded batch.
+    Returns one label per text, 'error' for the texts that could not be classified'''
+    #texts seen before (same normalized text, same model version) are answered from the cache,
+    #repeats inside the batch go through the model once
+    version = registry.version(name)
+    keys = [cache_key(name, version, text) for text in texts]
+    labels = classification_cache.get_many(name, keys)
+    missing = {}
+    for key, text, label in zip(keys, texts, labels):
+        if label is None and key not in missing:
+            missing[key] = text
+    if not missing:
+        return labels
+
+    t0 = perf_counter()
+    computed = dict(zip(missing, run_pipeline(name, list(missing.values()), aggregate)))
+    #the model may have loaded on another backend than the version said, its labels aren't that version's
+    if registry.version(name) == version:
+        classification_cache.put_many(name, [(key, label) for key, label in computed.items() if label != 'error'],
+                                      seconds=perf_counter() - t0)
+    return [label if label is not None else computed[key] for key, label in zip(keys, labels)]
+
+def run_pipeline(name, texts, aggregate):
     try:
-        sentiment_classifier = get_sentiment_classifier()
-        output = sentiment_classifier(text)
-        print("Sentiment raw output:", output )
-        sentiment = LABELS[sentiment_classifier(text)[0]['label']]
-
+        classifier = registry.get(name)
     except Exception as e:
-        print(e)
-        sentiment = 'error'
+        log.error("%s model error: %s", name, e)
+        CLASSIFICATION_ERRORS.inc(len(texts), model=name)
+        return ['error'] * len(texts)
+    #inference time of one batch (model loading is not counted)
+    with STAGE_SECONDS.time(stage=name):
+        labels = label_texts(classifier, texts, aggregate, name)
+    errors = labels.count('error')
+    if errors:
+        CLASSIFICATION_ERRORS.inc(errors, model=name)
+    return labels
+
+def label_texts(classifier, texts, aggregate, name="model"):
+    '''Labels from one pipeline object, no cache and no registry (benchmarks compare backends with this)'''
+    #every text becomes one or more windows that fit the model, all windows of the batch go
+    #through the model together so cost grows with total length instead of failing on long posts
+    tokenizer = getattr(classifier, "tokenizer", None)
+    windows = [split_windows(tokenizer, text) for text in texts]
+    pieces = [piece for text_windows in windows for piece, _ in text_windows]
 
     try:
-        toxicity_classifier = get_toxicity_classifier()
-        output = toxicity_classifier(text)
-        print("Toxicity raw output:", output)
-        label = output[0]['label']
-        score = output[0]['score']
-
-        # Example mapping - adjust based on your model
-        if label == "toxic" and score > 0.7:
-            toxicity = "TOXIC"
-        else:
-            toxicity = "NON_TOXIC"
+        outputs = classifier(pieces, batch_size=min(len(pieces), WINDOW_BATCH_SIZE), top_k=None, truncation=True)
+        log.debug("%s raw output: %s", name, outputs)
+        labels = []
+        position = 0
+        for text_windows in windows:
+            text_outputs = outputs[position:position + len(text_windows)]
+            position += len(text_windows)
+            labels.append(aggregate(text_outputs, [n_tokens for _, n_tokens in text_windows]))
+        return labels
     except Exception as e:
-        print("Toxicity error:", e) 
-        toxicity = 'error'
+        log.warning("%s batch error, retrying one text at a time: %s", name, e)
+
+    #one bad text should not fail everyone else in the batch
+    labels = []
+    for text_windows in windows:
+        try:
+            outputs = classifier([piece for piece, _ in text_windows], top_k=None, truncation=True)
+            labels.append(aggregate(outputs, [n_tokens for _, n_tokens in text_windows]))
+        except Exception as e:
+            log.error("%s error: %s", name, e)
+            labels.append('error')
+    return labels
+
+def analyze_sentiment_toxicity_batch(texts):
+    sentiments = classify_batch("sentiment", texts, sentiment_aggregate)
+    toxicities = classify_batch("toxicity", texts, toxicity_aggregate)
+    return [{'sentiment': s, 'toxicity': t} for s, t in zip(sentiments, toxicities)]
 
+def analyze_sentiment_toxicity(text): 
+    return analyze_sentiment_toxicity_batch([text])[0]
+
+def cached_analysis(text):
+    '''The result for a text both models have already classified, else None (nothing is run)'''
+    keys = {name: cache_key(name, registry.version(name), text) for name in ("sentiment", "toxicity")}
+    if None in classification_cache.peek_many(keys.values()):
+        return None
+    sentiment, = classification_cache.get_many("sentiment", [keys["sentiment"]])
+    toxicity, = classification_cache.get_many("toxicity", [keys["toxicity"]])
+    if sentiment is None or toxicity is None: #evicted in between
+        return None
     return {'sentiment': sentiment, 'toxicity': toxicity}
 
+#the moderation list is compiled once and reloaded when the file changes, see keyword_matcher.py
+#matching is case-insensitive and by whitespace-separated token, so results are cached per lowercased text
 def flag_keywords(text):
-    try:
-        moderation_list = []
-        with open('./moderation_list.txt', 'r') as file:
-            for line in file:
-                moderation_list.append(line.rstrip())
-    except Exception as e: 
-        print(e)
-        return []
-
-    text_lower = text.lower()
-    text_lower = clean(text) 
-    text_list = text_lower.split(' ')
-    flagged_keywords = []
-    # for word in moderation_list:
-    #     if word in text_lower:
-    #         flagged_keywords.append(word)
-    
-    for word in text_list:
-        if word in moderation_list: 
-            flagged_keywords.append(word) 
-            
-    return flagged_keywords
-
+    return flag_keywords_batch([text])[0]
+
+def flag_keywords_batch(texts):
+    version = matcher.version
+    keys = [cache_key("keywords", version, text, lowercase=True) if isinstance(text, str) else None for text in texts]
+    found = classification_cache.get_many("keywords", [key for key in keys if key is not None])
+    results = []
+    cached = iter(found)
+    for key in keys:
+        results.append(next(cached) if key is not None else [])
+    missing = [i for i, (key, result) in enumerate(zip(keys, results)) if key is not None and result is None]
+    if missing:
+        t0 = perf_counter()
+        scanned = matcher.scan_many([texts[i] for i in missing])
+        seconds = perf_counter() - t0
+        STAGE_SECONDS.observe(seconds, stage="keywords")
+        classification_cache.put_many("keywords", [(keys[i], result) for i, result in zip(missing, scanned)],
+                                      seconds=seconds)
+        for i, result in zip(missing, scanned):
+            results[i] = result
+    return results
+
+#normalisation lives in text_normalizer.py (precompiled tables, cached by content hash, no printing)
 def clean(text): 
-    if not isinstance(text, str):
-        return ""
-    #convert to lowercase and remove 
-    text = text.lower() 
-    regex_pattern = f"[{re.escape(string.punctuation)}]"
-    text = re.sub(regex_pattern, "", text)
-    text = re.sub(r'\s+', ' ', text).strip()   
-    tokens = [word for word in text.split() if word not in ENGLISH_STOP_WORDS]
-    print("Cleaned Text: \n", tokens)
-    return ' '.join(tokens)
-
-input_file = "content_log.json"
-output_file = "content_log_cleaned.json"
-
-# with open(input_file, "r") as infile, open(output_file, "w") as outfile:
-#     for line in infile:
-#         try:
-#             entry = json.loads(line)
-#             raw_text = entry.get("raw_text") or entry.get("text") or ""
-#             entry["cleaned_text"] = clean(raw_text)
-#             outfile.write(json.dumps(entry) + "\n")
-#         except json.JSONDecodeError as e:
-#             print("Error in cleaning, skipping malformed line:", e)
+    return text_normalizer.clean(text)
+
+def clean_many(texts):
+    return text_normalizer.clean_many(texts)
+
+#the content log is rebuilt from the raw entries (or older exports) with backfill.py
 
 # if __name__ == "__main__":
 #     print('hello')
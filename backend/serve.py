@@ -0,0 +1,242 @@
+#production server: the models, stores and caches are loaded once in a master process, which then
+#forks the web workers (serving app.py on one shared socket) and a refresher
+#   python serve.py [--workers N] [--host HOST] [--port 5050] [--torch-threads N]
+#forked workers share the preloaded model weights copy-on-write instead of loading a copy each,
+#so adding a worker costs its own working memory, not another set of models
+#writes from several processes are safe: the stores append under a file lock (entry_store.py),
+#the classification cache merges on save, and the refresher is the only process that redraws the
+#dashboard, updates the topic model and writes the index snapshots (the analytics snapshot's
+#parquet files too), the web workers read what it saved (/analytics/<name>/png serves its last drawing)
+#the master restarts workers that die (the refresher then re-queues entries they left unmoderated)
+#and stops them all on SIGINT/SIGTERM, in-flight moderations are finished first
+#/metrics and the other metrics endpoints describe the worker process that answered the request
+#app.py's own __main__ is still the single-process development server
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from time import perf_counter
+
+from process_local import cpu_count
+
+log = logging.getLogger(__name__)
+
+#web worker processes, each answers requests in threads and batches its own submissions
+WORKERS = int(os.environ.get("WEB_WORKERS", "0")) or cpu_count()
+#torch threads per web worker, 0 = the cpus divided between the workers so they don't oversubscribe
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", "0"))
+#seconds between the refresher's looks at the content log
+REFRESH_EVERY = float(os.environ.get("REFRESH_EVERY", "2.0"))
+
+WEB = "web"
+REFRESHER = "refresher"
+
+def set_torch_threads(threads):
+    '''Intra-op threads torch may use in this process (nothing to do without torch)'''
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass #only possible before torch's first parallel work in this process
+
+def preload():
+    '''Load everything the workers should share before forking them'''
+    import app
+    import columnar_snapshot #the analytics snapshot is built and saved before the fork too
+    from classification_cache import classification_cache
+    from entry_store import raw_store, log_store
+    from model_registry import registry
+    from topic_engine import topic_engine
+
+    t0 = perf_counter()
+    #one thread while loading: torch's thread pool must not exist yet when the workers are forked
+    set_torch_threads(1)
+    load_times = registry.warm_up()
+    log.info("Loaded models: %s", load_times)
+    #the stores replay their logs and build every index, the classification cache and the topic
+    #model are read from disk
+    log.info("Loaded %d entries and %d moderation records", len(raw_store), len(log_store))
+    classification_cache.load()
+    topic_engine.topics()
+    #snapshots the replay brought up to date, written now so no saver thread is mid-save at the fork
+    for store in (raw_store, log_store):
+        store.save_indexes()
+    #everything loaded so far is moved out of the garbage collector's reach, a collection in a
+    #worker would otherwise write to (and so copy) every page holding one of these objects
+    gc.collect()
+    gc.freeze()
+    log.info("Preloaded in %0.1fs", perf_counter() - t0)
+    return app.app
+
+
+#master: forks the workers, restarts the ones that die, stops them all on a signal
+class Prefork:
+    def __init__(self, app, workers=WORKERS, host="127.0.0.1", port=5050, torch_threads=TORCH_THREADS):
+        self.app = app
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.torch_threads = torch_threads or max(1, cpu_count() // workers)
+        self.children = {} #pid -> role
+        self.stopping = False
+        self.socket = None
+
+    def run(self):
+        #bound once here, every web worker accepts on the same socket and the kernel spreads the connections
+        self.socket = socket.create_server((self.host, self.port), backlog=128)
+        self.socket.set_inheritable(True)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self._spawn(REFRESHER)
+        for _ in range(self.workers):
+            self._spawn(WEB)
+        log.warning("Serving on http://%s:%d with %d web worker(s), %d torch thread(s) each (master %d)",
+                    self.host, self.port, self.workers, self.torch_threads, os.getpid())
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            role = self.children.pop(pid, None)
+            if role is None or self.stopping:
+                continue
+            log.warning("%s worker %d exited with status %d, starting a new one", role, pid, os.waitstatus_to_exitcode(status))
+            self._spawn(role)
+            if role == WEB:
+                #its queued entries were saved but not moderated
+                self._signal(REFRESHER, signal.SIGUSR1)
+        self.socket.close()
+
+    def _signal(self, role, signum):
+        for pid, child_role in list(self.children.items()):
+            if role is None or child_role == role:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def _stop(self, signum, frame):
+        if not self.stopping:
+            log.warning("Stopping workers")
+        self.stopping = True
+        self._signal(None, signal.SIGTERM)
+
+    def _spawn(self, role):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = role
+            return pid
+
+        #child: never returns into the master's loop
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN) #the master decides when to stop
+            if role == WEB:
+                self._serve()
+            else:
+                self._refresh()
+        except Exception:
+            log.exception("%s worker %d failed", role, os.getpid())
+            code = 1
+        finally:
+            try:
+                flush()
+            finally:
+                os._exit(code)
+
+    def _serve(self):
+        from werkzeug.serving import make_server
+        from columnar_snapshot import analytics_snapshot
+        from entry_store import raw_store, log_store
+        from moderation_jobs import pipeline
+        from render_scheduler import render_scheduler
+        from topic_engine import topic_engine
+
+        set_torch_threads(self.torch_threads)
+        #the refresher draws the dashboard (png exports included), updates the topic model and saves
+        #the index snapshots for everyone
+        pipeline.render_on_write = False
+        render_scheduler.writer = False
+        topic_engine.writer = False
+        analytics_snapshot.writer = False
+        for store in (raw_store, log_store):
+            store.autosave = False
+
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+        #shutdown() waits for serve_forever to return, so it can't run in the signal handler itself
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        server.serve_forever()
+        server.server_close()
+        pipeline.shutdown()
+
+    def _refresh(self):
+        from app import recover_pending
+        from entry_store import raw_store, log_store
+        from moderation_jobs import pipeline, RENDER_ON_WRITE
+        from render_scheduler import render_scheduler
+        from topic_engine import topic_engine
+
+        self.socket.close()
+        set_torch_threads(1)
+        pipeline.render_on_write = False #it refreshes whenever the log changed anyway
+        stop, recover = threading.Event(), threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: recover.set())
+
+        #entries saved but never moderated, e.g. the server stopped mid-pipeline
+        recover.set()
+        version = None
+        while not stop.is_set():
+            if recover.is_set():
+                recover.clear()
+                log.info("Re-queued unmoderated entries: %d", recover_pending())
+            #the web workers' writes, applied here so this process's saver keeps the snapshots current
+            raw_store.refresh()
+            if log_store.version != version:
+                version = log_store.version
+                try:
+                    if RENDER_ON_WRITE:
+                        render_scheduler.refresh()
+                    else:
+                        topic_engine.update()
+                except Exception:
+                    log.exception("Dashboard refresh failed")
+            stop.wait(REFRESH_EVERY)
+        pipeline.shutdown()
+
+def flush():
+    #what atexit would save in a normal exit, a forked worker leaves with os._exit
+    from classification_cache import classification_cache
+    from entry_store import raw_store, log_store
+
+    for store in (raw_store, log_store):
+        store.save_indexes()
+    classification_cache.save()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the backend with preloaded models in several worker processes")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="web worker processes (default: one per cpu)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--torch-threads", type=int, default=TORCH_THREADS,
+                        help="torch threads per web worker (default: cpus / workers)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper(),
+                        format="%(asctime)s %(levelname)s %(process)d %(name)s: %(message)s")
+    app = preload()
+    Prefork(app, max(1, args.workers), args.host, args.port, args.torch_threads).run()
+    #the workers saved the indexes and caches, the master's copies are older than theirs
+    sys.stdout.flush()
+    os._exit(0)
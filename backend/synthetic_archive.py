@@ -0,0 +1,143 @@
+#synthetic archives for benchmarks: user-text.json and content_log_cleaned.json with n entries,
+#shaped like the real ones (same fields, same moderation records), generated from a seed so
+#every run of a benchmark sees exactly the same data
+#   python synthetic_archive.py n [directory] [--seed N]
+#entries are posts and replies (threads several levels deep), 0-3 tags, a share of them carry
+#words from moderation_list.txt and a few are long essays (well over one model window)
+import argparse
+import json
+import os
+import random
+import uuid
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from keyword_matcher import MODERATION_LIST
+
+REPLY_SHARE = 0.3
+FLAGGED_SHARE = 0.15
+ESSAY_SHARE = 0.02
+SENTIMENTS = (("POSITIVE", 0.45), ("NEUTRAL", 0.3), ("NEGATIVE", 0.2), ("MIXED", 0.05))
+START = datetime(2025, 1, 1)
+
+#real words (stop words included, so cleaning has something to drop) followed by made-up ones,
+#drawn with zipf-like weights so term frequencies look like natural text
+COMMON_WORDS = ("the and to of a i in that is it was my for me with as but have be this not they are "
+                "so on at we all about from feel family people culture identity home think like know "
+                "adoption adoptee parents mother father language school friends life story years").split()
+SYLLABLES = ("ka", "lo", "mi", "ren", "ta", "vo", "shi", "an", "el", "dor", "pa", "ri", "sun", "ve", "mo", "ti")
+TAGS = ("identity", "family", "adoption", "culture", "language", "school", "belonging", "grief", "travel",
+        "reunion", "heritage", "food", "holidays", "siblings", "racism", "community", "music", "faith",
+        "names", "birthland", "citizenship", "therapy", "dating", "work", "parenting")
+
+def vocabulary(rng, size=5000):
+    words = list(COMMON_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def moderation_words(path=MODERATION_LIST):
+    with open(path, "r", encoding="utf-8") as f:
+        #single words only, phrases would be split by the sentence generator anyway
+        return [line.strip() for line in f if line.strip() and " " not in line.strip()]
+
+class ArchiveGenerator:
+    def __init__(self, seed=0, moderation_list=MODERATION_LIST):
+        self.rng = random.Random(seed)
+        self.words = vocabulary(self.rng)
+        self.cum_weights = list(accumulate(1 / rank for rank in range(1, len(self.words) + 1)))
+        self.tag_weights = list(accumulate(1 / rank for rank in range(1, len(TAGS) + 1)))
+        self.flag_words = moderation_words(moderation_list)
+
+    def sentence(self, n_words):
+        total = self.cum_weights[-1]
+        picks = [self.words[bisect(self.cum_weights, self.rng.random() * total)] for _ in range(n_words)]
+        return " ".join(picks).capitalize() + "."
+
+    def text(self, essay=False):
+        if essay:
+            #several paragraphs, 1500-3000 words
+            paragraphs = [" ".join(self.sentence(self.rng.randint(8, 25)) for _ in range(self.rng.randint(6, 12)))
+                          for _ in range(self.rng.randint(8, 14))]
+            return "\n\n".join(paragraphs)
+        return " ".join(self.sentence(self.rng.randint(5, 20)) for _ in range(self.rng.randint(1, 6)))
+
+    def tags(self):
+        total = self.tag_weights[-1]
+        return sorted({TAGS[bisect(self.tag_weights, self.rng.random() * total)]
+                       for _ in range(self.rng.choice((0, 1, 1, 2, 3)))})
+
+    def raw_entries(self, n):
+        timestamp = START
+        ids = []
+        for _ in range(n):
+            timestamp += timedelta(seconds=self.rng.randint(1, 600), microseconds=self.rng.randint(0, 999999))
+            entry_id = str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+            text = self.text(essay=self.rng.random() < ESSAY_SHARE)
+            keywords = []
+            if self.rng.random() < FLAGGED_SHARE:
+                keywords = self.rng.sample(self.flag_words, self.rng.randint(1, 2))
+                words = text.split(" ")
+                for keyword in keywords:
+                    words.insert(self.rng.randrange(len(words) + 1), keyword)
+                text = " ".join(words)
+            #replies answer a recent post more often than an old one, so threads get deep
+            parent_id = None
+            if ids and self.rng.random() < REPLY_SHARE:
+                parent_id = ids[max(0, len(ids) - 1 - int(self.rng.expovariate(1 / 20)))]
+            ids.append(entry_id)
+            yield {
+                "timestamp": timestamp.isoformat(),
+                "id": entry_id,
+                "title": " ".join(text.split()[:self.rng.randint(3, 7)]).rstrip(".").lower(),
+                "text": text,
+                "tags": self.tags(),
+                "parent_id": parent_id
+            }, keywords
+
+    def analysis(self, keywords):
+        sentiment = self.rng.choices([s for s, _ in SENTIMENTS], [w for _, w in SENTIMENTS])[0]
+        toxic = self.rng.random() < (0.5 if keywords else 0.03)
+        return {"sentiment": sentiment, "toxicity": "TOXIC" if toxic else "NON_TOXIC"}
+
+def generate(n, seed=0, moderation_list=MODERATION_LIST):
+    '''(raw entries, content log entries) of a synthetic archive with n entries'''
+    from moderation_jobs import moderation_record
+    from log_moderation import log_record
+
+    generator = ArchiveGenerator(seed, moderation_list)
+    raw, logged = [], []
+    for entry, keywords in generator.raw_entries(n):
+        raw.append(entry)
+        logged.append(log_record(*moderation_record(entry, generator.analysis(keywords), keywords)))
+    return raw, logged
+
+def write_archive(directory, n, seed=0, moderation_list=MODERATION_LIST):
+    '''Writes user-text.json and content_log_cleaned.json for n entries into directory'''
+    raw, logged = generate(n, seed, moderation_list)
+    tag_dict = {}
+    for entry in raw:
+        for tag in entry["tags"]:
+            tag_dict.setdefault(tag, []).append(entry["id"])
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "user-text.json"), "w", encoding="utf-8") as f:
+        json.dump({"entries": raw, "tag_dict": tag_dict}, f, indent=4)
+    with open(os.path.join(directory, "content_log_cleaned.json"), "w", encoding="utf-8") as f:
+        json.dump(logged, f, indent=2)
+    return raw, logged
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic user-text.json/content_log_cleaned.json")
+    parser.add_argument("n", type=int, help="number of entries")
+    parser.add_argument("directory", nargs="?", default="synthetic_archive")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    raw, logged = write_archive(args.directory, args.n, args.seed)
+    replies = sum(entry["parent_id"] is not None for entry in raw)
+    flagged = sum(entry["flagged"] for entry in logged)
+    print(f"Wrote {len(raw)} entries ({replies} replies, {flagged} flagged) to {args.directory}")
@@ -0,0 +1,58 @@
+from itertools import islice
+
+from entry_store import StoreIndex, raw_store
+
+#inverted tag index: tag -> ids of the entries carrying it
+#kept up to date by the raw store on every put/delete and snapshotted to tag_index.json,
+#so nothing ever walks all entries to rebuild it
+class TagIndex(StoreIndex):
+    def reset(self):
+        #dicts used as insertion-ordered sets: O(1) add/remove/membership, ids stay in post order
+        self.tags = {}
+
+    def on_put(self, entry):
+        for tag in entry.get("tags") or []:
+            self.tags.setdefault(tag, {})[entry["id"]] = None
+
+    def on_delete(self, entry):
+        #only the tags of the deleted entry are touched
+        for tag in entry.get("tags") or []:
+            ids = self.tags.get(tag)
+            if ids is None:
+                continue
+            ids.pop(entry["id"], None)
+            if not ids: #if the tag has no entries left delete the key
+                del self.tags[tag]
+
+    def to_snapshot(self):
+        return {tag: list(ids) for tag, ids in self.tags.items()}
+
+    def from_snapshot(self, state):
+        self.tags = {tag: dict.fromkeys(ids) for tag, ids in state.items()}
+
+    #queries, always read through the store so other processes' writes are applied first
+    def as_dict(self):
+        '''tag -> list of ids, the tag_dict shape the frontend expects'''
+        with self.store.reading():
+            return {tag: list(ids) for tag, ids in self.tags.items()}
+
+    def counts(self):
+        with self.store.reading():
+            return {tag: len(ids) for tag, ids in self.tags.items()}
+
+    def has(self, tag, entry_id):
+        with self.store.reading():
+            return entry_id in self.tags.get(tag, {})
+
+    def page(self, tag, offset=0, limit=50):
+        '''Entries for one tag, newest first, returns (total, entries)'''
+        with self.store.reading():
+            ids = self.tags.get(tag, {})
+            total = len(ids)
+            #ids are kept in post order, walked backwards so the first page holds the latest posts
+            page_ids = list(islice(reversed(ids), offset, offset + limit))
+            return total, [self.store.get(entry_id) for entry_id in page_ids]
+
+
+tag_index = TagIndex("tag_index.json")
+raw_store.add_index(tag_index)
@@ -0,0 +1,66 @@
+import hashlib
+import string
+import threading
+from collections import OrderedDict
+
+#built once at import instead of on every call
+PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+#how many cleaned texts to remember
+CACHE_SIZE = 100_000
+
+_cache = OrderedDict() #content hash -> cleaned text, least recently used first
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+_stop_words = None
+
+def stop_words():
+    '''sklearn's english stop words, sklearn itself is only imported the first time they are needed'''
+    global _stop_words
+    if _stop_words is None:
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+        _stop_words = frozenset(ENGLISH_STOP_WORDS)
+    return _stop_words
+
+def content_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+def normalize(text):
+    '''lowercase, strip punctuation, collapse whitespace and drop stop words (no caching)'''
+    tokens = text.lower().translate(PUNCTUATION).split()
+    stop = stop_words()
+    return ' '.join([word for word in tokens if word not in stop])
+
+def clean(text):
+    if not isinstance(text, str):
+        return ""
+
+    #the same text (e.g. a re-logged or quoted post) is only ever cleaned once
+    key = content_hash(text)
+    with _cache_lock:
+        cleaned = _cache.get(key)
+        if cleaned is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return cleaned
+
+    cleaned = normalize(text)
+    with _cache_lock:
+        _stats["misses"] += 1
+        _cache[key] = cleaned
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return cleaned
+
+def clean_many(texts):
+    '''clean() over a list or pandas Series, returns the same kind of container'''
+    if hasattr(texts, "map"):
+        #pandas Series: clean each distinct text once and map the results back
+        unique = {text: clean(text) for text in texts.unique()} if len(texts) else {}
+        return texts.map(lambda text: unique.get(text, "") if isinstance(text, str) else "")
+    return [clean(text) for text in texts]
+
+def cache_stats():
+    with _cache_lock:
+        return {"size": len(_cache), **_stats}
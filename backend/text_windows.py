@@ -0,0 +1,42 @@
+import os
+
+#longest input the moderation models take (both are 512-token BERT-style models)
+MAX_MODEL_TOKENS = 512
+#tokens shared by two neighbouring windows, so a phrase cut at a window edge is still seen whole once
+WINDOW_OVERLAP = int(os.environ.get("WINDOW_OVERLAP", "64"))
+
+def window_size(tokenizer):
+    #room left for the model's own special tokens (<s> </s>, [CLS] [SEP])
+    limit = min(getattr(tokenizer, "model_max_length", MAX_MODEL_TOKENS) or MAX_MODEL_TOKENS, MAX_MODEL_TOKENS)
+    return limit - tokenizer.num_special_tokens_to_add()
+
+def split_windows(tokenizer, text, overlap=WINDOW_OVERLAP):
+    '''Split a text into overlapping pieces that each fit the model, as (piece, token count) pairs.
+    A text that already fits comes back whole, a model without a tokenizer gets the text unchanged'''
+    if tokenizer is None or not isinstance(text, str):
+        return [(text, 1)]
+    size = window_size(tokenizer)
+    try:
+        encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        offsets = encoded["offset_mapping"]
+    except (NotImplementedError, ValueError, TypeError):
+        #slow tokenizers have no offsets, cut on the decoded tokens instead
+        ids = tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"]
+        offsets = None
+
+    n_tokens = len(offsets) if offsets is not None else len(ids)
+    if n_tokens <= size:
+        return [(text, max(n_tokens, 1))]
+
+    step = max(size - overlap, 1)
+    windows = []
+    for start in range(0, n_tokens, step):
+        end = min(start + size, n_tokens)
+        if offsets is not None:
+            piece = text[offsets[start][0]:offsets[end - 1][1]]
+        else:
+            piece = tokenizer.decode(ids[start:end])
+        windows.append((piece, end - start))
+        if end == n_tokens:
+            break
+    return windows
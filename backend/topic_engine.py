@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+from time import time
+
+from entry_store import StoreIndex, log_store, atomic_write_json, temp_path
+from text_normalizer import clean_many
+
+log = logging.getLogger(__name__)
+
+N_FEATURES = 1000
+N_TOPICS = 8
+#full refit once this many entries were added/removed since the last one (and at least REFIT_RATIO
+#of the corpus), or when the last refit is older than REFIT_INTERVAL seconds; otherwise new posts
+#are folded in with a mini-batch update on the fixed vocabulary
+REFIT_MIN_CHANGES = 500
+REFIT_RATIO = 0.2
+REFIT_INTERVAL = 24 * 60 * 60
+
+def entry_document(entry):
+    return (entry.get('title') or '') + ' ' + (entry.get('text') or '')
+
+
+#incremental topic model over the content log, the tf-idf matrix stays sparse throughout
+#new posts are queued by the log store (StoreIndex) and applied with MiniBatchNMF.partial_fit,
+#model state is kept in topic_model.joblib between runs, it (and sklearn) is only loaded the first
+#time the topics are updated or read
+#with several server processes only one of them is the writer (serve.py's refresher), the others
+#set writer = False: they keep no pending documents and read the model again whenever it was saved
+class TopicEngine(StoreIndex):
+    def __init__(self, snapshot_path, model_path):
+        super().__init__(snapshot_path)
+        self.model_path = model_path
+        self.vectorizer = None
+        self.nmf = None
+        self.docs_at_refit = 0
+        self.refit_time = 0
+        self.model_loaded = False
+        self.writer = True
+        self._model_stamp = None #(inode, mtime) of the model file when it was loaded/saved
+        self._update_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    #StoreIndex: only remember what changed, the work happens in update()
+    def reset(self):
+        self.pending = []
+        self.changes = 0
+        self.needs_refit = True
+
+    def on_put(self, entry):
+        self.changes += 1
+        if self.writer and not self.needs_refit:
+            self.pending.append(entry_document(entry))
+
+    def on_delete(self, entry):
+        #nmf can't forget a document, deletes are picked up by the next full refit
+        self.changes += 1
+
+    def to_snapshot(self):
+        return {"pending": list(self.pending), "changes": self.changes, "needs_refit": self.needs_refit}
+
+    def from_snapshot(self, state):
+        self.pending = state.get("pending", [])
+        self.changes = state.get("changes", 0)
+        self.needs_refit = state.get("needs_refit", True)
+
+    def checkpoint(self):
+        #the snapshot goes with the writer's model, a reader's state would not match it
+        if self.writer:
+            return super().checkpoint()
+        self._unsaved = 0
+        return lambda: None
+
+    def _stat_model(self):
+        try:
+            stat = os.stat(self.model_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    @property
+    def model_version(self):
+        '''Changes every time a new model is saved (by any process)'''
+        return self._stat_model()
+
+    def _load_model(self):
+        with self._model_lock:
+            if self.model_loaded and (self.writer or self._model_stamp == self._stat_model()):
+                return
+            import joblib
+            self._model_stamp = self._stat_model()
+            try:
+                model = joblib.load(self.model_path)
+                self.vectorizer = model["vectorizer"]
+                self.nmf = model["nmf"]
+                self.docs_at_refit = model["docs_at_refit"]
+                self.refit_time = model["refit_time"]
+            except FileNotFoundError:
+                self.needs_refit = True
+            except Exception as e:
+                log.warning("Ignoring unreadable topic model %s: %s", self.model_path, e)
+                self.needs_refit = True
+            self.model_loaded = True
+
+    def _save_model(self):
+        import joblib
+
+        tmp = temp_path(self.model_path)
+        joblib.dump({
+            "vectorizer": self.vectorizer,
+            "nmf": self.nmf,
+            "docs_at_refit": self.docs_at_refit,
+            "refit_time": self.refit_time
+        }, tmp)
+        os.replace(tmp, self.model_path)
+        self._model_stamp = self._stat_model()
+
+    def refit_due(self):
+        if self.needs_refit or self.nmf is None:
+            return True
+        if time() - self.refit_time > REFIT_INTERVAL:
+            return True
+        return self.changes >= REFIT_MIN_CHANGES and self.changes >= REFIT_RATIO * max(self.docs_at_refit, 1)
+
+    def update(self, force_refit=False):
+        '''Bring the model up to date: a full refit when one is due, else a mini-batch update'''
+        self._load_model()
+        if not self.writer:
+            return False
+        with self._update_lock:
+            with self.store.reading():
+                refit = force_refit or self.refit_due()
+                if refit:
+                    documents = [entry_document(entry) for entry in self.store.entries()]
+                    self.changes = 0
+                else:
+                    documents = self.pending
+                self.pending = []
+                self.needs_refit = False
+                seq, changes = self.seq, self.changes
+
+            if not refit and not documents:
+                return False
+
+            t0 = time()
+            if refit:
+                self._refit(documents)
+            else:
+                X = self.vectorizer.transform(clean_many(documents))
+                self.nmf.partial_fit(X)
+
+            if self.nmf is not None:
+                log.info("Topic model %s with %d documents in %0.3fs.",
+                         "refit" if refit else "updated", len(documents), time() - t0)
+                self._save_model()
+            #the snapshot only claims what the saved model contains, anything logged after
+            #`seq` is replayed from the log into pending on the next start
+            atomic_write_json(self.snapshot_path, {
+                "seq": seq,
+                "state": {"pending": [], "changes": changes, "needs_refit": self.nmf is None}
+            })
+            return True
+
+    def _refit(self, documents):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.decomposition import MiniBatchNMF
+
+        cleaned = [doc for doc in clean_many(documents) if doc]
+        if len(cleaned) < N_TOPICS:
+            log.warning("Not enough documents for %d topics", N_TOPICS)
+            return
+        vectorizer = TfidfVectorizer(max_features = N_FEATURES, ngram_range=(1,2))
+        X = vectorizer.fit_transform(cleaned) #sparse, never turned into a dense matrix
+        nmf = MiniBatchNMF(n_components = N_TOPICS, random_state = 1).fit(X)
+        self.vectorizer, self.nmf = vectorizer, nmf
+        self.docs_at_refit = len(cleaned)
+        self.refit_time = time()
+
+    def topics(self, n_top_words=5):
+        '''(terms, weights) for each topic, heaviest term first'''
+        self._load_model()
+        if self.nmf is None:
+            return []
+        features = self.vectorizer.get_feature_names_out()
+        topics = []
+        for topic in self.nmf.components_:
+            top_indices = topic.argsort()[:-n_top_words - 1:-1]
+            topics.append(([features[i] for i in top_indices], [float(topic[i]) for i in top_indices]))
+        return topics
+
+
+topic_engine = TopicEngine("topic_state.json", "topic_model.joblib")
+log_store.add_index(topic_engine)
@@ -9,20 +9,29 @@ function TextInput() {
   const [response, setResponse] = useState(""); // For storing backend response
   const [storedData, setStoredData] = useState([]);  //managing and updating stored data 
   const [replyingTo, setReplyingTo] = useState(null); //state whether user is writing entry or replying
-  const [tagIndex, setTagIndex] = useState({});   //store tag mappings in dict
+  const [tagIndex, setTagIndex] = useState({});   //store tag counts in dict
+  const [latestCursor, setLatestCursor] = useState(null); //cursor of the newest entry we have, for fetching only new ones
+  const [olderCursor, setOlderCursor] = useState(null); //next_cursor of the last page, null once every older entry is loaded
   const [selectedTag, setSelectedTag] = useState(null); //button state for selecting tags 
   const [filteredEntries, setFilteredEntries] = useState([]); //state for sselecting entries associated with a tag to visualize
+  const [tagTotal, setTagTotal] = useState(0); //number of entries carrying the selected tag
   
   //function that gets data from the backend app.py 
+  //the backend pages entries newest first, we keep them oldest first for display
   const fetchStoredData = async () => {
     try{ 
       //first fetch the prexisting data 
-      const res = await fetch("http://127.0.0.1:5050/get-data"); 
+      const res = await fetch("http://127.0.0.1:5050/get-data?limit=200"); 
       const data = await res.json(); 
       ///log response 
       console.log("Fetched Data:", data);
-      setStoredData(data.entries || []);  //load entries or return empty list if there are none
-      setTagIndex(data.tag_dict || {});  //load tag mappings or return empty dict if there are none
+      const entries = data.entries || []; //load entries or return empty list if there are none
+      setStoredData([...entries].reverse());  
+      setOlderCursor(data.next_cursor || null); 
+      if (entries.length > 0) {
+        setLatestCursor(`${entries[0].timestamp}|${entries[0].id}`);
+      }
+      fetchTags(); 
     }
     catch (error) {
       //if this happens, backend error might be occuring 
@@ -30,6 +39,51 @@ function TextInput() {
     }
   };
 
+  //the next page of older entries, they go above the ones already shown
+  const fetchOlderEntries = async () => {
+    if (!olderCursor) {
+      return; 
+    }
+    try {
+      const res = await fetch(`http://127.0.0.1:5050/get-data?limit=200&cursor=${encodeURIComponent(olderCursor)}`); 
+      const data = await res.json(); 
+      setStoredData((prev) => [...(data.entries || []).reverse(), ...prev]); 
+      setOlderCursor(data.next_cursor || null); 
+    }
+    catch (error) {
+      console.error("Cannot fetch older entries:", error); 
+    }
+  };
+
+  //after a submit only ask for the entries newer than the newest one we already have
+  const fetchNewEntries = async () => {
+    if (!latestCursor) {
+      return fetchStoredData(); 
+    }
+    try {
+      const res = await fetch(`http://127.0.0.1:5050/get-data?since=${encodeURIComponent(latestCursor)}`); 
+      const data = await res.json(); 
+      setStoredData((prev) => [...prev, ...(data.entries || [])]); 
+      setLatestCursor(data.since || latestCursor); 
+      fetchTags(); 
+    }
+    catch (error) {
+      console.error("Cannot fetch new entries:", error); 
+    }
+  };
+
+  //tag names with the number of entries for each
+  const fetchTags = async () => {
+    try {
+      const res = await fetch("http://127.0.0.1:5050/tags"); 
+      const data = await res.json(); 
+      setTagIndex(data || {});  //load tag counts or return empty dict if there are none
+    }
+    catch (error) {
+      console.error("Cannot fetch tags:", error); 
+    }
+  };
+
   useEffect(() => {
     fetchStoredData(); // Load stored data on component mount
   }, []);
@@ -69,7 +123,7 @@ function TextInput() {
       setTitle(""); 
       setTags(''); 
       setReplyingTo(null); //reset reply mode 
-      fetchStoredData(); 
+      fetchNewEntries(); 
 
     } catch (error) {
       console.error("Error adding entry:", error);
@@ -88,17 +142,33 @@ function TextInput() {
   }; 
 
   //function for when user clicks a Tag 
-  const handleTagClick = (tag) => {
+  const handleTagClick = async (tag) => {
     //show backend response (for debugig) 
     console.log(`highlighting entries for tag: ${tag}"`); 
-    //first check that there are items in the dict
-    if (tagIndex[tag]){
-      // get relatedEntries by  filtering all entries by the tag
-      const relatedEntries = storedData.filter((entry) => 
-      tagIndex[tag].includes(entry.id)); 
+    //ask the backend for the entries with this tag instead of filtering everything here
+    try {
+      const res = await fetch(`http://127.0.0.1:5050/tags/${encodeURIComponent(tag)}?limit=100`); 
+      const data = await res.json(); 
       //set states
       setSelectedTag(tag);  
-      setFilteredEntries(relatedEntries); 
+      setFilteredEntries(data.entries || []); 
+      setTagTotal(data.total || 0); 
+    }
+    catch (error) {
+      console.error("Cannot fetch tagged entries:", error); 
+    }
+  }
+
+  //the backend returns tagged entries newest first, the next page starts after the ones shown
+  const fetchMoreTagged = async () => {
+    try {
+      const res = await fetch(`http://127.0.0.1:5050/tags/${encodeURIComponent(selectedTag)}?limit=100&offset=${filteredEntries.length}`); 
+      const data = await res.json(); 
+      setFilteredEntries((prev) => [...prev, ...(data.entries || [])]); 
+      setTagTotal(data.total || 0); 
+    }
+    catch (error) {
+      console.error("Cannot fetch tagged entries:", error); 
     }
   }
 
@@ -138,12 +208,16 @@ function TextInput() {
       {/* iterating through the tag_dict and displaying a button for each one */}
       {Object.keys(tagIndex || {}).map((tag) => (
         <button key={tag} onClick={() => handleTagClick(tag)}>
-          {tag} ({tagIndex[tag].length})
+          {tag} ({tagIndex[tag]})
         </button>
       ))}
 
       {/* display the stored data  */}
       <h3>Stored Entries:</h3>
+      {/* only offer older entries while the backend says there are more */}
+      {olderCursor && (
+        <button onClick={fetchOlderEntries}> Load older entries </button>
+      )}
       <ul>
         {/* iterate through each item of the stored data */}
         {storedData.map((item, index) => (
@@ -175,6 +249,9 @@ function TextInput() {
                 </li>
               ))}
             </ul>
+            {filteredEntries.length < tagTotal && (
+              <button onClick={fetchMoreTagged}> Load more </button>
+            )}
           </div> 
           <button onClick={() => setSelectedTag(null)}> X </button>
 